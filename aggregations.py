@@ -0,0 +1,319 @@
+import numpy as np
+import pandas as pd
+
+import sketches
+
+# =============================
+# AGRÉGATIONS PARTAGÉES
+# =============================
+# Table département × année calculée une seule fois (à la construction du
+# cache) et lue par toutes les pages.
+
+QUANTILES = (0.10, 0.25, 0.75, 0.90)
+
+
+def sort_groups(df, keys, value_col):
+    """Trie les lignes valides par groupe `keys` puis par valeur.
+
+    Renvoie (codes de groupe, valeurs, lignes d'origine), dans l'ordre trié :
+    chaque groupe est une tranche contiguë de valeurs croissantes.
+    """
+    codes = df.groupby(keys, observed=True, sort=True).ngroup().to_numpy()
+    values = df[value_col].to_numpy(dtype=np.float64)
+
+    valid = ~np.isnan(values) & (codes >= 0)
+    codes = codes[valid]
+    values = values[valid]
+    rows = np.flatnonzero(valid)
+
+    order = np.lexsort((values, codes))
+    return codes[order], values[order], rows[order]
+
+
+def slice_stats(values, starts, quantiles=QUANTILES):
+    """Médiane, moyenne, effectif et quantiles de chaque tranche triée de `values`.
+
+    La tranche i va de starts[i] à starts[i + 1] (ou à la fin du tableau) ;
+    quantiles par interpolation linéaire, comme pandas.
+    """
+    counts = np.diff(np.r_[starts, len(values)])
+
+    def quantile(q):
+        pos = starts + q * (counts - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+    stats = {
+        "Valeur_mediane": quantile(0.5),
+        "Valeur_moyenne": np.add.reduceat(values, starts) / counts,
+        "Nb_transactions": counts,
+    }
+    for q in quantiles:
+        stats[f"Valeur_q{int(round(q * 100))}"] = quantile(q)
+    return stats
+
+
+def stat_columns(quantiles=QUANTILES):
+    return ["Valeur_mediane", "Valeur_moyenne", "Nb_transactions"] + [
+        f"Valeur_q{int(round(q * 100))}" for q in quantiles
+    ]
+
+
+def grouped_stats(df, keys, value_col, quantiles=QUANTILES):
+    """Médiane, moyenne, effectif et quantiles de `value_col` par groupe.
+
+    Un seul tri (groupe puis valeur) suffit : chaque groupe devient une
+    tranche contiguë du tableau trié, dont on lit directement les quantiles ;
+    les sommes sont faites par `np.add.reduceat` sur les mêmes tranches.
+    """
+    codes, values, rows = sort_groups(df, keys, value_col)
+    if len(values) == 0:
+        return pd.DataFrame(columns=list(keys) + stat_columns(quantiles))
+
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    result = df.iloc[rows[starts]][list(keys)].reset_index(drop=True)
+    for col, stat in slice_stats(values, starts, quantiles).items():
+        result[col] = stat
+    return result
+
+
+def price_per_m2_stats(foncieres, keys):
+    """Prix au m² (médiane, moyenne, quantiles) par groupe `keys`.
+
+    Prix = valeur foncière / surface réelle bâtie de la mutation, calculé sur
+    les seules mutations avec une surface bâtie (terrains nus écartés) ;
+    `Nb_transactions` compte ces mutations.
+    """
+    surface = foncieres["Surface reelle bati"].to_numpy(dtype=np.float64)
+    built = surface > 0
+    cells = foncieres.loc[built, list(keys)].reset_index(drop=True)
+    cells["Prix m2"] = foncieres["Valeur fonciere"].to_numpy(dtype=np.float64)[built] / surface[built]
+    return grouped_stats(cells, keys, "Prix m2")
+
+
+def normalize_pop_dep(pop_dep_all):
+    """Population départementale avec la clé `Code departement` au format DVF."""
+    pop = pop_dep_all.rename(columns={"Code_departement": "Code departement"}).copy()
+    pop["Code departement"] = pop["Code departement"].astype(str).str.zfill(2)
+    pop["annee"] = pop["annee"].astype(int)
+    return pop
+
+
+def join_pop_dep(stats, pop_dep_all=None):
+    """Jointure à gauche de la population départementale sur la table de statistiques."""
+    if pop_dep_all is not None and len(pop_dep_all) > 0:
+        stats = stats.merge(
+            normalize_pop_dep(pop_dep_all),
+            on=["Code departement", "annee"],
+            how="left",
+        )
+    return stats.sort_values(["Code departement", "annee"]).reset_index(drop=True)
+
+
+def department_stats(foncieres_all):
+    """Table département × année, cube temporel et sketches du cube (voir time_cube).
+
+    La population INSEE est jointe ensuite par `join_pop_dep`.
+    """
+    stats, cube, cube_sketches = time_cube(foncieres_all, "Code departement")
+    stats["Code departement"] = stats["Code departement"].astype(str)
+    stats["annee"] = stats["annee"].astype(int)
+    return stats, cube, cube_sketches
+
+
+def fill_population(df, pop_dep_all, method="locf", columns=None):
+    """Complète la population de `df` pour les couples département/année absents de l'INSEE.
+
+    Une seule jointure `merge_asof` par département associe à chaque année la
+    dernière estimation disponible (ou, avant la première, la plus proche) :
+    - method="locf" : cette dernière valeur est reprise telle quelle ;
+    - method="linear" : la tendance entre les deux dernières estimations
+      est prolongée jusqu'à l'année demandée.
+    Les colonnes texte (ex. Nom_departement) sont toujours reprises telles quelles.
+    Seules les valeurs manquantes de `df` sont remplacées.
+    """
+    if method not in ("locf", "linear"):
+        raise ValueError(f"Méthode de complétion inconnue : {method}")
+
+    pop = normalize_pop_dep(pop_dep_all)
+    if columns is None:
+        columns = [c for c in pop.columns if c.startswith("Ensemble") or c == "Nom_departement"]
+    columns = [c for c in columns if c in pop.columns]
+    numeric = [c for c in columns if pd.api.types.is_numeric_dtype(pop[c])]
+
+    pop = pop[["Code departement", "annee"] + columns].sort_values("annee")
+    pop = pop.rename(columns={"annee": "annee_obs"})
+    if method == "linear":
+        by_dep = pop.sort_values(["Code departement", "annee_obs"]).groupby("Code departement")
+        prev = by_dep[["annee_obs"] + numeric].shift(1).add_suffix("_prec")
+        pop = pop.join(prev)
+
+    out = df.copy()
+    out["Code departement"] = out["Code departement"].astype(str)
+    target = out[["Code departement", "annee"]].drop_duplicates()
+    target = target.assign(annee=target["annee"].astype(int)).sort_values("annee")
+
+    def asof(direction):
+        return pd.merge_asof(
+            target, pop, left_on="annee", right_on="annee_obs",
+            by="Code departement", direction=direction,
+        )
+
+    filled = asof("backward")
+    # Années antérieures à la première estimation : valeur la plus proche
+    before = filled["annee_obs"].isna()
+    if before.any():
+        forward = asof("forward")
+        filled.loc[before] = forward.loc[before].to_numpy()
+
+    if method == "linear":
+        ecart = filled["annee"] - filled["annee_obs"]
+        duree = filled["annee_obs"] - filled["annee_obs_prec"]
+        for col in numeric:
+            pente = (filled[col] - filled[f"{col}_prec"]) / duree
+            extrapole = filled[col] + pente * ecart
+            filled[col] = extrapole.where((ecart > 0) & pente.notna(), filled[col])
+
+    filled = filled[["Code departement", "annee"] + columns]
+    out = out.merge(filled, on=["Code departement", "annee"], how="left", suffixes=("", "_rempli"))
+    for col in columns:
+        if col in df.columns:
+            out[col] = out[col].fillna(out[f"{col}_rempli"])
+            out = out.drop(columns=f"{col}_rempli")
+    return out
+
+
+def commune_stats(foncieres_all):
+    """Table commune × année (clé `code_insee` entière), cube temporel et sketches du cube.
+
+    Les transactions sans commune identifiable (code_insee = -1) sont ignorées.
+    """
+    stats, cube, cube_sketches = time_cube(foncieres_all, "code_insee")
+    stats["code_insee"] = stats["code_insee"].astype(np.int32)
+    stats["annee"] = stats["annee"].astype(np.int16)
+    return stats, cube, cube_sketches
+
+
+def commune_panel(transactions, population):
+    """Panel commune × année : médiane, effectif et population de l'année.
+
+    `transactions` : colonnes `code_pop` (clé de la ligne de population,
+    -1 si aucune), `annee`, `Valeur fonciere`. `population` : colonnes
+    `code_pop`, `annee`, `population`. Une année sans recensement prend la
+    population de l'année disponible la plus proche (colonne `annee_pop`).
+    """
+    known = transactions[transactions["code_pop"].to_numpy() >= 0]
+    stats = grouped_stats(known, ["code_pop", "annee"], "Valeur fonciere", quantiles=())
+
+    annees_pop = np.sort(population["annee"].unique()).astype(np.int64)
+    annees = stats["annee"].to_numpy().astype(np.int64)
+    if len(annees_pop):
+        annee_pop = annees_pop[np.abs(annees[:, None] - annees_pop[None, :]).argmin(axis=1)]
+    else:
+        annee_pop = annees
+    stats["annee_pop"] = annee_pop
+    stats = stats.merge(
+        population.rename(columns={"annee": "annee_pop"}), on=["code_pop", "annee_pop"], how="left"
+    )
+
+    return pd.DataFrame({
+        "code_pop": stats["code_pop"].to_numpy().astype(np.int32),
+        "annee": stats["annee"].to_numpy().astype(np.int16),
+        "Valeur_mediane": stats["Valeur_mediane"].to_numpy().astype(np.float32),
+        "Nb_transactions": stats["Nb_transactions"].to_numpy().astype(np.int32),
+        "population": stats["population"].fillna(-1).to_numpy().astype(np.int32),
+        "annee_pop": stats["annee_pop"].to_numpy().astype(np.int16),
+    }).sort_values(["annee", "code_pop"]).reset_index(drop=True)
+
+
+def _run_starts(values):
+    """Masque des débuts de suites de valeurs identiques (tableau vide accepté)."""
+    new = np.ones(len(values), dtype=bool)
+    new[1:] = values[1:] != values[:-1]
+    return new
+
+
+def _cells(df, key, rows, **columns):
+    """Clés `key` et `annee` des lignes `rows` de `df`, suivies de `columns`."""
+    cells = df.iloc[rows][[key, "annee"]].reset_index(drop=True)
+    for name, values in columns.items():
+        cells[name] = values
+    return cells
+
+
+def time_cube(foncieres_all, key):
+    """Statistiques par `key` × année et cube temporel par mois et trimestre, en un seul tri.
+
+    Les transactions sont triées une fois par `key`, année puis valeur. Les
+    lignes d'un mois (ou d'un trimestre) extraites de cet ordre le gardent :
+    chaque cellule `key` × année × période est déjà une tranche triée, dont
+    on lit les quantiles et le sketch (suites d'intervalles identiques) sans
+    second tri. `periode` vaut "M" (numero = mois 1-12) ou "T" (numero =
+    trimestre 1-4). Pour `key="code_insee"`, les communes inconnues (-1) sont
+    ignorées.
+
+    Renvoie (table `key` × année, cube, sketches creux de chaque cellule du cube).
+    """
+    df = foncieres_all[[key, "annee", "mois", "Valeur fonciere"]]
+    if key == "code_insee":
+        df = df[df["code_insee"].to_numpy() >= 0]
+    codes, values, rows = sort_groups(df, [key, "annee"], "Valeur fonciere")
+
+    starts = np.flatnonzero(_run_starts(codes))
+    year_stats = _cells(df, key, rows[starts], **slice_stats(values, starts))
+
+    mois = df["mois"].to_numpy()[rows]
+    buckets = sketches.bucket_index(values)
+    cubes, cube_sketches = [], []
+    for periode, numero in (("M", mois), ("T", (mois - 1) // 3 + 1)):
+        stats, counts = [], []
+        for k in np.unique(numero):
+            idx = np.flatnonzero(numero == k)
+            new_cell = _run_starts(codes[idx])
+            first = np.flatnonzero(new_cell)
+            stats.append(_cells(df, key, rows[idx[first]], numero=k, **slice_stats(values[idx], first)))
+            # Valeurs triées dans la cellule : chaque intervalle du sketch est une suite
+            bucket = buckets[idx]
+            runs = np.flatnonzero(new_cell | _run_starts(bucket))
+            counts.append(_cells(
+                df, key, rows[idx[runs]], numero=k, bucket=bucket[runs], n=np.diff(np.r_[runs, len(idx)])
+            ))
+        # Aucune transaction : tables vides, mais avec leurs colonnes
+        stats = stats or [_cells(df, key, rows, numero=rows, **slice_stats(values, starts))]
+        counts = counts or [_cells(df, key, rows, numero=rows, bucket=rows, n=rows)]
+        for frames, target in ((stats, cubes), (counts, cube_sketches)):
+            part = pd.concat(frames, ignore_index=True).sort_values([key, "annee", "numero"], kind="stable")
+            part.insert(2, "periode", periode)
+            target.append(part)
+
+    cube = pd.concat(cubes, ignore_index=True)
+    cube_sketches = pd.concat(cube_sketches, ignore_index=True)
+    for frame in (cube, cube_sketches):
+        frame["periode"] = frame["periode"].astype(pd.CategoricalDtype(["M", "T"]))
+        frame["annee"] = frame["annee"].astype(np.int16)
+        frame["numero"] = frame["numero"].astype(np.int8)
+    cube["Nb_transactions"] = cube["Nb_transactions"].astype(np.int32)
+    valeurs = [c for c in cube.columns if c.startswith("Valeur_")]
+    cube[valeurs] = cube[valeurs].astype(np.float32)
+    cube_sketches["bucket"] = cube_sketches["bucket"].astype(np.int16)
+    cube_sketches["n"] = cube_sketches["n"].astype(np.int32)
+    return year_stats, cube, cube_sketches
+
+
+def update_dep_year_stats(previous, new_stats, years, pop_dep_all=None):
+    """Remplace les années `years` de la table par celles de `new_stats` (department_stats).
+
+    Les autres années sont reprises telles quelles ; seule la jointure avec la
+    population (quelques centaines de lignes) est refaite.
+    """
+    stat_cols = [
+        c for c in previous.columns
+        if c in ("Code departement", "annee", "Nb_transactions") or c.startswith("Valeur_")
+    ]
+    years = [int(a) for a in years]
+    kept = previous.loc[~previous["annee"].isin(years), stat_cols]
+    frames = [kept]
+    if len(new_stats) > 0:
+        frames.append(new_stats[new_stats["annee"].isin(years)])
+    return join_pop_dep(pd.concat(frames, ignore_index=True), pop_dep_all)
@@ -1,26 +1,140 @@
 import dash
-from dash import dcc, html, Input, Output
-from data_loader import extract_all_zips
+from dash import dcc, html, Input, Output, Patch
+from dash.exceptions import PreventUpdate
+from data_loader import ensure_cache, extract_all_zips
+import data_store
+import geo
+import importlib
+import importlib.util
 import os
+import threading
+import time
 
-# Extraire les fichiers ZIP seulement si nécessaire
-# Vérifier si un fichier "marker" existe pour éviter de ré-extraire à chaque redémarrage
-if not os.path.exists('.extracted'):
-    extract_all_zips()
-    # Créer un fichier marker pour indiquer que l'extraction est faite
-    with open('.extracted', 'w') as f:
-        f.write('done')
+# Extraire les archives de population seulement si elles ont changé :
+# data/extracted.json garde l'empreinte de chaque archive déjà extraite
+# (les archives DVF sont lues directement dans le ZIP)
+extract_all_zips()
 
 # Créer l'application Dash
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 
 # IMPORTANT: Cette ligne doit être APRÈS app = dash.Dash()
 server = app.server
+# Variantes simplifiées du GeoJSON des départements (data/geo), construites
+# au déploiement (gunicorn.conf.py, ou ci-dessous avec `python app.py`) et non
+# à l'import : sans elles, la carte retombe sur le GeoJSON distant
+geo.register_routes(server)
 
-# Importer les modules des pages après l'instanciation de l'application
-from pages import home, page1, page2, page3, page4
 from pages.navigation import create_nav_bar
 
+# =============================
+# PAGES CHARGÉES À LA DEMANDE
+# =============================
+# Chaque module de page calcule ses données et ses figures à l'import :
+# il n'est importé qu'à la première visite (ou par le préchargement en
+# arrière-plan), puis gardé en mémoire.
+PAGES = {
+    '/': 'pages.home',
+    '/page1': 'pages.page1',
+    '/page2': 'pages.page2',
+    '/page3': 'pages.page3',
+    '/page4': 'pages.page4',
+    '/page5': 'pages.page5',
+    '/page6': 'pages.page6',
+}
+_page_modules = {}
+_page_locks = {module_name: threading.Lock() for module_name in PAGES.values()}
+
+
+def get_page(module_name):
+    """Module de la page, construit une seule fois même avec des requêtes simultanées."""
+    module = _page_modules.get(module_name)
+    if module is None:
+        with _page_locks[module_name]:
+            module = _page_modules.get(module_name)
+            if module is None:
+                module = importlib.import_module(module_name)
+                _page_modules[module_name] = module
+    return module
+
+
+def warm_up_pages():
+    """Construit toutes les pages en arrière-plan, l'accueil en premier."""
+    for module_name in PAGES.values():
+        try:
+            module = get_page(module_name)
+            # Pages interactives : index ou données chargés par les callbacks
+            if hasattr(module, 'warm_up'):
+                module.warm_up()
+        except Exception as e:
+            print(f"⚠ Préchargement de {module_name} impossible : {e}")
+
+
+# Les pages interactives sont importées tout de suite : leurs callbacks
+# doivent être enregistrés avant la première requête (import sans calcul)
+get_page('pages.page2')
+get_page('pages.page6')
+
+# Désactivable avec DASH_WARMUP=0 (les pages sont alors construites à la première visite)
+if os.environ.get('DASH_WARMUP', '1') == '1':
+    threading.Thread(target=warm_up_pages, name='warm-up-pages', daemon=True).start()
+
+# =============================
+# RAFRAÎCHISSEMENT DES DONNÉES EN ARRIÈRE-PLAN
+# =============================
+# Avec DVF_REFRESH_INTERVAL=<secondes> (0 = désactivé), un thread vérifie
+# régulièrement les fichiers sources. Si une nouvelle publication a été
+# déposée dans data/, le cache est mis à jour hors du chemin des requêtes,
+# chaque page déjà construite est reconstruite dans un nouveau module, puis
+# les modules servis sont remplacés. Une requête en cours garde le module
+# (donc la version des données) qu'elle a déjà lu ; les suivantes voient la
+# nouvelle version. Sur disque, les fichiers de la version précédente ne
+# sont ni réécrits ni supprimés par la mise à jour (voir data_store). Les pages interactives lisent l'index de la version
+# courante à chaque callback : seul leur préchargement est relancé.
+REFRESH_INTERVAL = int(os.environ.get('DVF_REFRESH_INTERVAL', '0'))
+
+
+def build_page(module_name):
+    """Nouvelle instance d'un module de page, sans toucher à celle qui est servie."""
+    spec = importlib.util.find_spec(module_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def refresh_pages():
+    """Reconstruit les pages déjà chargées sur la version courante du cache."""
+    for module_name, module in list(_page_modules.items()):
+        if hasattr(module, 'warm_up'):
+            module.warm_up()
+            continue
+        with _page_locks[module_name]:
+            new_module = build_page(module_name)
+            # Remplacement atomique : une seule affectation dans le dictionnaire
+            _page_modules[module_name] = new_module
+
+
+def refresh_loop():
+    """Met à jour le cache et les pages dès qu'une source change."""
+    served_version = data_store.dataset_version()
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            version = ensure_cache()['version']
+            if version == served_version:
+                continue
+            debut = time.perf_counter()
+            print(f"Nouvelle version des données ({version}) : reconstruction des pages...")
+            refresh_pages()
+            served_version = version
+            print(f"✓ Pages servies sur la nouvelle version en {time.perf_counter() - debut:.1f}s")
+        except Exception as e:
+            print(f"⚠ Rafraîchissement des données impossible : {e}")
+
+
+if REFRESH_INTERVAL > 0:
+    threading.Thread(target=refresh_loop, name='refresh-data', daemon=True).start()
+
 # Layout principal
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),  # Gère l'URL
@@ -34,17 +148,34 @@ app.layout = html.Div([
     Input('url', 'pathname')
 )
 def display_page(pathname):
-    if pathname == '/page1':
-        return page1.layout
-    elif pathname == '/page2':
-        return page2.layout
-    elif pathname == '/page3':
-        return page3.layout
-    elif pathname == '/page4':
-        return page4.layout
-    else:  # Accueil ou URL inconnue
-        return home.layout
+    # Accueil pour une URL inconnue
+    module_name = PAGES.get(pathname, PAGES['/'])
+    layout = get_page(module_name).layout
+    # Layout fonction : recalculé à chaque visite (ex. années disponibles)
+    return layout() if callable(layout) else layout
+
+# =============================
+# CARTE : VARIANTE SELON LE ZOOM
+# =============================
+@app.callback(
+    Output('carte-departements', 'figure'),
+    Input('carte-departements', 'relayoutData'),
+    prevent_initial_call=True
+)
+def adapt_map_geometry(relayout_data):
+    """Remplace le GeoJSON de la carte par la variante adaptée au zoom."""
+    scale = (relayout_data or {}).get('geo.projection.scale')
+    if scale is None:
+        raise PreventUpdate
+    url = geo.departements_geojson(scale)
+    figure = get_page(PAGES['/']).figures['fig']
+    patch = Patch()
+    patch['data'][0]['geojson'] = url
+    for i in range(len(figure.get('frames', []))):
+        patch['frames'][i]['data'][0]['geojson'] = url
+    return patch
 
 # Lancement de l'application
 if __name__ == "__main__":
+    geo.build_variants()
     app.run(debug=True, use_reloader=False)
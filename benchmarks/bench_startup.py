@@ -0,0 +1,353 @@
+"""Benchmark du démarrage : ingestion DVF, cache et construction des pages.
+
+Génère des fichiers DVF synthétiques (même format que data.gouv : texte
+séparé par '|', dans une archive ValeursFoncieres-AAAA.zip) et des tables
+de population au format INSEE, puis chronomètre chaque étape et note le pic
+de mémoire (RSS). Les résultats sont écrits en JSON pour comparer les commits.
+
+Exemples :
+    python benchmarks/bench_startup.py --rows 1M
+    python benchmarks/bench_startup.py --rows 20M --workers 4 --output resultats.json
+"""
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+PAGES = ["pages.home", "pages.page1", "pages.page2", "pages.page3", "pages.page4", "pages.page5", "pages.page6"]
+
+DVF_COLUMNS = [
+    "Identifiant de document", "Reference document", "No disposition", "Date mutation",
+    "Nature mutation", "Valeur fonciere", "No voie", "Type de voie", "Voie", "Code postal",
+    "Commune", "Code departement", "Code commune", "Section", "No plan", "Nombre de lots",
+    "Code type local", "Type local", "Surface reelle bati", "Nombre pieces principales",
+    "Nature culture", "Surface terrain",
+]
+
+DEPTS = (
+    [f"{i}" for i in range(1, 20)] + ["2A", "2B"] + [f"{i}" for i in range(21, 96)]
+    + ["971", "972", "973", "974"]
+)
+TYPES_LOCAL = np.array(["Maison", "Appartement", "Dépendance", "Local industriel. commercial ou assimilé", ""])
+CODES_TYPE_LOCAL = np.array(["1", "2", "3", "4", ""])
+AGE_COLS = [
+    "Ensemble_0 à 19 ans", "Ensemble_20 à 39 ans", "Ensemble_40 à 59 ans",
+    "Ensemble_60 à 74 ans", "Ensemble_75 ans et plus",
+]
+
+
+# =============================
+# MESURES
+# =============================
+def peak_rss_mb():
+    """Pic de RSS du processus depuis son lancement (Mo)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Ko sous Linux, octets sous macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+class Timer:
+    def __init__(self):
+        self.stages = []
+
+    def run(self, name, func, *args, rows=None, **kwargs):
+        debut = time.perf_counter()
+        result = func(*args, **kwargs)
+        duree = time.perf_counter() - debut
+        stage = {
+            "stage": name,
+            "seconds": round(duree, 4),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "rss_mb": None if current_rss_mb() is None else round(current_rss_mb(), 1),
+        }
+        if rows:
+            stage["rows"] = int(rows)
+            stage["rows_per_second"] = round(rows / max(duree, 1e-9))
+        self.stages.append(stage)
+        print(f"  {name:<36} {duree:8.2f}s   pic RSS {stage['peak_rss_mb']:>9,.0f} Mo")
+        return result
+
+
+# =============================
+# DONNÉES SYNTHÉTIQUES
+# =============================
+def parse_rows(value):
+    value = value.strip().upper()
+    factor = {"K": 1_000, "M": 1_000_000}.get(value[-1], 1)
+    return int(float(value.rstrip("KM")) * factor)
+
+
+def synthetic_dvf_chunk(rng, n, annee):
+    dept_idx = rng.integers(0, len(DEPTS), n)
+    dept = np.array(DEPTS)[dept_idx]
+
+    # DOM : le numéro de commune commence par le 3e chiffre du département (97101 → "101")
+    commune = rng.integers(1, 700, n)
+    dom_prefix = np.array([d[2] if len(d) == 3 else "" for d in DEPTS])[dept_idx]
+    commune_dom = np.char.add(dom_prefix, np.char.zfill((commune % 100).astype(str), 2))
+    commune = np.where(dom_prefix != "", commune_dom, commune.astype(str))
+
+    valeurs = np.round(rng.lognormal(12, 0.8, n), 2)
+    valeurs_txt = np.char.replace(np.char.mod("%.2f", valeurs), ".", ",")
+    valeurs_txt[rng.random(n) < 0.02] = ""
+
+    jours = np.char.zfill(rng.integers(1, 29, n).astype(str), 2)
+    mois = np.char.zfill(rng.integers(1, 13, n).astype(str), 2)
+    dates = np.char.add(np.char.add(np.char.add(jours, "/"), np.char.add(mois, "/")), str(annee))
+
+    type_idx = rng.integers(0, len(TYPES_LOCAL), n)
+    bati = np.isin(type_idx, [0, 1])
+    surface = np.where(bati, rng.integers(15, 250, n).astype(str), "")
+
+    return pd.DataFrame({
+        "Identifiant de document": "",
+        "Reference document": "",
+        "No disposition": "000001",
+        "Date mutation": dates,
+        "Nature mutation": "Vente",
+        "Valeur fonciere": valeurs_txt,
+        "No voie": rng.integers(1, 200, n),
+        "Type de voie": "RUE",
+        "Voie": "DE LA GARE",
+        "Code postal": rng.integers(1000, 97500, n),
+        "Commune": "COMMUNE",
+        "Code departement": dept,
+        "Code commune": commune,
+        "Section": "AB",
+        "No plan": rng.integers(1, 999, n),
+        "Nombre de lots": 0,
+        "Code type local": CODES_TYPE_LOCAL[type_idx],
+        "Type local": TYPES_LOCAL[type_idx],
+        "Surface reelle bati": surface,
+        "Nombre pieces principales": np.where(bati, rng.integers(1, 8, n).astype(str), ""),
+        "Nature culture": "",
+        "Surface terrain": "",
+    }, columns=DVF_COLUMNS)
+
+
+def write_dvf_archives(data_dir, rows, years, seed=0, chunk=1_000_000):
+    """Écrit `rows` lignes réparties sur `years` dans des archives ZIP DVF."""
+    rng = np.random.default_rng(seed)
+    per_year = rows // len(years)
+    for annee in years:
+        txt_path = os.path.join(data_dir, f"ValeursFoncieres-{annee}.txt")
+        with open(txt_path, "w", encoding="utf-8") as f:
+            remaining = per_year
+            first = True
+            while remaining > 0:
+                n = min(chunk, remaining)
+                synthetic_dvf_chunk(rng, n, annee).to_csv(f, sep="|", index=False, header=first)
+                first = False
+                remaining -= n
+        with zipfile.ZipFile(os.path.join(data_dir, f"ValeursFoncieres-{annee}.zip"), "w",
+                             zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+            z.write(txt_path, os.path.basename(txt_path))
+        os.remove(txt_path)
+
+
+def write_pop_archives(data_dir, pop_dep, pop_communes):
+    """Archives de population aux noms INSEE attendus par data_loader.pop_zips.
+
+    Les classeurs sont remplacés par des CSV (les chargeurs de population
+    sont eux-mêmes remplacés par les tables synthétiques) : l'étape
+    extract_all_zips décompresse ainsi de vraies archives, sans classeurs INSEE.
+    """
+    archives = {
+        "base-pop-historiques-1876-2023.zip": ("base-pop-historiques-1876-2023.csv", pop_communes),
+        "estim-pop-dep-sexe-gca-1975-2026.zip": ("estim-pop-dep-sexe-gca-1975-2026.csv", pop_dep),
+    }
+    for zip_name, (file_name, df) in archives.items():
+        with zipfile.ZipFile(os.path.join(data_dir, zip_name), "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(file_name, df.to_csv(sep=";", index=False))
+
+
+def synthetic_pop_dep(seed=0):
+    rng = np.random.default_rng(seed)
+    codes = [d.zfill(2) for d in DEPTS] + ["976"]
+    frames = []
+    for annee in range(2020, 2027):
+        ages = rng.integers(20_000, 400_000, (len(codes), len(AGE_COLS)))
+        df = pd.DataFrame(ages, columns=AGE_COLS).astype(float)
+        df.insert(0, "Code_departement", codes)
+        df.insert(1, "Nom_departement", [f"Département {c}" for c in codes])
+        df.insert(2, "Ensemble_Total", ages.sum(axis=1).astype(float))
+        df["annee"] = annee
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True)
+
+
+def synthetic_pop_communes(seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for d in DEPTS:
+        dep = d.zfill(2)
+        for c in range(1, 700):
+            code = f"{dep[:2]}{d[2]}{c % 100:02d}" if len(d) == 3 else f"{dep}{c:03d}"
+            rows.append((code, dep))
+    df = pd.DataFrame(rows, columns=["code_commune", "code_departement"]).drop_duplicates("code_commune")
+    df.insert(1, "code_region", "00")
+    df.insert(3, "nom_commune", "Commune " + df["code_commune"])
+    for annee in range(2020, 2024):
+        df[f"pop_{annee}"] = rng.integers(50, 200_000, len(df))
+    return df.reset_index(drop=True)
+
+
+# =============================
+# ÉTAPES
+# =============================
+def parse_and_clean(data_loader, years):
+    """Lecture CSV et nettoyage chronométrés séparément, bloc par bloc."""
+    t_parse = t_clean = 0.0
+    n = 0
+    for annee in years:
+        iterator = iter(data_loader.iter_dvf_chunks(data_loader.dvf_source(annee)))
+        while True:
+            debut = time.perf_counter()
+            chunk = next(iterator, None)
+            t_parse += time.perf_counter() - debut
+            if chunk is None:
+                break
+            n += len(chunk)
+            debut = time.perf_counter()
+            data_loader.clean_dvf_chunk(chunk, annee)
+            t_clean += time.perf_counter() - debut
+    return n, t_parse, t_clean
+
+
+def load_page(module_name):
+    """Import d'une page puis, comme app.py, son préchargement (`warm_up`) s'il existe.
+
+    Les pages interactives ne calculent rien à l'import : sans `warm_up`, leur
+    coût n'apparaîtrait qu'à la première visite.
+    """
+    module = importlib.import_module(module_name)
+    if hasattr(module, "warm_up"):
+        module.warm_up()
+    return module
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="1M", help="nombre total de lignes DVF (ex. 1M, 5M, 20M, 50M)")
+    parser.add_argument("--years", default="2020-2025", help="plage d'années, ex. 2020-2025")
+    parser.add_argument("--workers", type=int, default=None, help="processus pour la lecture DVF")
+    parser.add_argument("--workdir", default=None, help="dossier de travail (temporaire par défaut)")
+    parser.add_argument("--keep", action="store_true", help="ne pas supprimer le dossier de travail")
+    parser.add_argument("--output", default=None, help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    rows = parse_rows(args.rows)
+    debut, fin = (int(a) for a in args.years.split("-"))
+    years = list(range(debut, fin + 1))
+    if args.workers is not None:
+        os.environ["DVF_WORKERS"] = str(args.workers)
+    os.environ["DASH_WARMUP"] = "0"
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench-dvf-")
+    data_dir = os.path.join(workdir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    print(f"Dossier de travail : {workdir}")
+
+    print(f"Génération de {rows:,} lignes DVF synthétiques...")
+    write_dvf_archives(data_dir, rows, years)
+    pop_dep = synthetic_pop_dep()
+    pop_communes = synthetic_pop_communes()
+    write_pop_archives(data_dir, pop_dep, pop_communes)
+
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import data_loader
+        import data_store
+
+        # Populations INSEE synthétiques à la place des classeurs Excel
+        data_loader.load_pop_dep = lambda: pop_dep.copy()
+        data_loader.load_pop_communes = lambda: pop_communes.copy()
+
+        timer = Timer()
+        # Archives de population seulement : les archives DVF sont lues dans le ZIP
+        timer.run("extract_all_zips (population)", data_loader.extract_all_zips)
+
+        n, t_parse, t_clean = parse_and_clean(data_loader, years)
+        for name, duree in (("csv_parse", t_parse), ("clean", t_clean)):
+            timer.stages.append({
+                "stage": name, "seconds": round(duree, 4), "rows": n,
+                "rows_per_second": round(n / max(duree, 1e-9)),
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            })
+            print(f"  {name:<36} {duree:8.2f}s")
+
+        foncieres_all = timer.run("load_dvf", data_loader.load_dvf, rows=n)
+        # Écriture seule de la table des transactions, puis construction
+        # complète du cache (qui relit les archives, agrège et écrit tout)
+        timer.run(
+            "cache_write (foncieres_all)", data_store.write_dataset,
+            "foncieres_all", foncieres_all, partition_col="annee_fichier", rows=n,
+        )
+        del foncieres_all
+        timer.run("build_cache (parse+aggregate+write)", data_loader.build_cache, rows=n)
+        timer.run("cache_read", data_loader.load_all_data, rows=n)
+        timer.run("load_dep_stats", data_loader.load_dep_stats)
+
+        for module_name in PAGES:
+            timer.run(f"page:{module_name.split('.')[-1]}", load_page, module_name)
+    finally:
+        os.chdir(cwd)
+        if not args.keep and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "rows": rows,
+        "years": years,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "cpu_count": os.cpu_count(),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": timer.stages,
+    }
+    output = args.output or os.path.join(
+        REPO_DIR, "benchmarks", "results", f"startup-{args.rows}-{result['commit'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,109 +1,627 @@
+import ctypes
+import io
 import os
+import re
+import json
+import shutil
+import threading
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
-import pickle
+
+import aggregations
+import data_store
+import sketches
 
 zip_folder = "data"
-cache_file = "data/cache_data.pkl"
 annees = range(2020, 2026)
 
+# Mode mémoire partagée : foncieres_all est ouvert en memmap (lecture seule)
+# au lieu d'être copié dans chaque worker gunicorn
+shared_memory = os.environ.get("DVF_SHARED_MEMORY", "0") == "1"
+
+# Nombre de lignes lues à la fois dans chaque fichier DVF
+dvf_chunksize = 1_000_000
+
+# Lecture parallèle : nombre de processus et découpage de chaque fichier annuel
+dvf_workers = int(os.environ.get("DVF_WORKERS", os.cpu_count() or 1))
+dvf_splits_per_year = int(os.environ.get("DVF_SPLITS_PER_YEAR", "1"))
+dvf_usecols = ["Date mutation", "Valeur fonciere", "Code departement", "Code commune"]
+# Colonnes identifiant une mutation : DVF répète la mutation sur une ligne par lot/parcelle
+dvf_mutation_cols = ["Date mutation", "Valeur fonciere", "Code departement", "Code commune"]
+
+# Colonnes DVF facultatives : absentes du premier chargement, ajoutées au
+# cache à la première demande (voir ensure_columns) sans relire le reste.
+# Agrégées sur la mutation : surface bâtie totale des lots, type du local
+# principal (premier de TYPES_LOCAL présent parmi les lots).
+dvf_lazy_columns = ["Surface reelle bati", "Type local"]
+TYPES_LOCAL = ["Maison", "Appartement", "Local industriel. commercial ou assimilé", "Dépendance"]
+type_local_dtype = pd.CategoricalDtype(TYPES_LOCAL)
+
 # =============================
 # EXTRACTION DES ZIP
 # =============================
+def dvf_years():
+    """Années DVF disponibles : archives ValeursFoncieres-AAAA.zip ou dossiers dvf_AAAA."""
+    found = set(annees)
+    if os.path.isdir(zip_folder):
+        for name in os.listdir(zip_folder):
+            match = re.match(r"^(?:ValeursFoncieres-(\d{4})\.zip|dvf_(\d{4}))$", name)
+            if match:
+                found.add(int(match.group(1) or match.group(2)))
+    return sorted(found)
+
+
+def dvf_zip_path(annee):
+    return os.path.join(zip_folder, f"ValeursFoncieres-{annee}.zip")
+
+
+# Manifeste des extractions : pour chaque archive, taille, mtime et SHA-256
+# au moment de l'extraction. Une archive remplacée est ré-extraite seule ;
+# une nouvelle archive n'oblige pas à tout refaire.
+extraction_manifest_file = os.path.join(zip_folder, "extracted.json")
+_extraction_lock = threading.Lock()
+
+
+def read_extraction_manifest():
+    if not os.path.exists(extraction_manifest_file):
+        return {}
+    with open(extraction_manifest_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _record_extraction(zip_path, entry):
+    with _extraction_lock:
+        manifest = read_extraction_manifest()
+        manifest[zip_path] = entry
+        tmp = f"{extraction_manifest_file}.tmp{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, extraction_manifest_file)
+
+
+def extract_zip(zip_path, extract_path, force=False):
+    """Extrait une archive si elle a changé depuis sa dernière extraction ; `force` ré-extrait toujours."""
+    if not os.path.exists(zip_path):
+        return False
+    previous = read_extraction_manifest()
+    entry = data_store.source_fingerprint([zip_path], previous=previous)[zip_path]
+    old = previous.get(zip_path)
+    if not force and old and old["sha256"] == entry["sha256"] and os.path.exists(extract_path):
+        return False
+    if os.path.exists(extract_path):
+        shutil.rmtree(extract_path)
+    os.makedirs(extract_path, exist_ok=True)
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        zip_ref.extractall(extract_path)
+    _record_extraction(zip_path, dict(entry, extract_path=extract_path))
+    return True
+
+
+pop_zips = {
+    os.path.join(zip_folder, "base-pop-historiques-1876-2023.zip"): os.path.join(zip_folder, "pop_communes"),
+    os.path.join(zip_folder, "estim-pop-dep-sexe-gca-1975-2026.zip"): os.path.join(zip_folder, "pop_departement"),
+}
+
+
 def extract_all_zips():
-    for annee in annees:
-        zip_path = os.path.join(zip_folder, f"ValeursFoncieres-{annee}.zip")
-        extract_path = os.path.join(zip_folder, f"dvf_{annee}")
-        if os.path.exists(zip_path) and not os.path.exists(extract_path):
-            os.makedirs(extract_path, exist_ok=True)
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(extract_path)
-
-    pop_communes_zip = os.path.join(zip_folder, "base-pop-historiques-1876-2023.zip")
-    pop_communes_extract = os.path.join(zip_folder, "pop_communes")
-    if os.path.exists(pop_communes_zip) and not os.path.exists(pop_communes_extract):
-        os.makedirs(pop_communes_extract, exist_ok=True)
-        with zipfile.ZipFile(pop_communes_zip, 'r') as zip_ref:
-            zip_ref.extractall(pop_communes_extract)
-
-    pop_dep_zip = os.path.join(zip_folder, "estim-pop-dep-sexe-gca-1975-2026.zip")
-    pop_dep_extract = os.path.join(zip_folder, "pop_departement")
-    if os.path.exists(pop_dep_zip) and not os.path.exists(pop_dep_extract):
-        os.makedirs(pop_dep_extract, exist_ok=True)
-        with zipfile.ZipFile(pop_dep_zip, 'r') as zip_ref:
-            zip_ref.extractall(pop_dep_extract)
-
-# =============================
-# CHARGEMENT DES DONNÉES
-# =============================
-def load_all_data():
-
-    if os.path.exists(cache_file):
-        with open(cache_file, 'rb') as f:
-            return pickle.load(f)
-
-    # -----------------------------
-    # DVF
-    # -----------------------------
-    dvf_list = []
-    for annee in annees:
-        extract_path = os.path.join(zip_folder, f"dvf_{annee}")
-        files = [f for f in os.listdir(extract_path) if f.endswith(".txt")]
-        if not files:
-            continue
+    """Extrait en parallèle les archives de population qui ont changé.
+
+    Les archives DVF ne sont plus extraites : elles sont lues directement
+    dans le ZIP (voir open_dvf).
+    """
+    with data_store.store_lock("extract"), ThreadPoolExecutor(max_workers=len(pop_zips)) as executor:
+        list(executor.map(lambda item: extract_zip(*item), pop_zips.items()))
+
+# =============================
+# ENCODAGE COMPACT DES CODES
+# =============================
+def format_code_dept(code):
+    code = str(code).strip()
+    if code.isdigit() and len(code) < 3:
+        return code.zfill(2)
+    return code
+
+
+# Codes département possibles, triés comme des chaînes (2A/2B entre 29 et 30)
+DEPT_CODES = sorted(
+    [f"{i:02d}" for i in range(1, 96) if i != 20] + ["2A", "2B"] + [f"97{i}" for i in range(1, 9)]
+)
+dept_dtype = pd.CategoricalDtype(DEPT_CODES)
+
+
+# Clé INSEE entière (int32) d'une commune : numéro de département × 1000 +
+# numéro de commune, comme le code INSEE lu en nombre (01053 → 1053,
+# 97101 → 97101). 2A et 2B n'étant pas numériques, la Corse-du-Sud utilise
+# 20000 + commune et la Haute-Corse 20500 + commune (numéros corses < 500).
+# -1 signale une commune inconnue.
+def dept_key_base(code):
+    if code == "2A":
+        return 20000
+    if code == "2B":
+        return 20500
+    return int(code[:2]) * 1000
+
+
+DEPT_KEY_BASE = np.array([dept_key_base(c) for c in DEPT_CODES], dtype=np.int32)
+
+
+def encode_dept(codes):
+    """Codes département bruts → catégorie `dept_dtype`.
+
+    La normalisation (zéro devant, espaces) ne porte que sur les valeurs
+    distinctes ; les lignes sont recodées par indexation de tableau.
+    """
+    cat = codes if isinstance(codes.dtype, pd.CategoricalDtype) else codes.astype("category")
+    normalized = [format_code_dept(c) for c in cat.cat.categories]
+    lookup = np.append(dept_dtype.categories.get_indexer(normalized), -1)
+    new_codes = lookup[cat.cat.codes.to_numpy()]  # code -1 (manquant) → dernier élément
+    return pd.Categorical.from_codes(new_codes, dtype=dept_dtype)
 
-        file_path = os.path.join(extract_path, files[0])
-        df_temp = pd.read_csv(
-            file_path,
+
+def insee_key(dept, communes):
+    """Clé INSEE int32 à partir des départements encodés et des codes commune DVF."""
+    cat = communes if isinstance(communes.dtype, pd.CategoricalDtype) else communes.astype("category")
+    numeros = pd.to_numeric(pd.Series(cat.cat.categories), errors="coerce").to_numpy()
+    numeros = np.append(numeros, np.nan)[cat.cat.codes.to_numpy()]
+
+    dept_codes = np.asarray(dept.codes)
+    base = np.append(DEPT_KEY_BASE, -1)[dept_codes]
+    key = np.where((dept_codes >= 0) & ~np.isnan(numeros), base + np.nan_to_num(numeros), -1)
+    return key.astype(np.int32)
+
+
+def insee_key_from_code(codes):
+    """Clé INSEE int32 à partir de codes INSEE texte ("01053", "2A004", "97101")."""
+    codes = pd.Series(codes).astype(str).str.strip().str.zfill(5)
+    dep = codes.str[:2]
+    base = dep.map({"2A": 20000, "2B": 20500}).fillna(pd.to_numeric(dep, errors="coerce") * 1000)
+    key = base + pd.to_numeric(codes.str[2:], errors="coerce")
+    return key.fillna(-1).to_numpy().astype(np.int32)
+
+
+# =============================
+# LECTURE DVF EN STREAMING
+# =============================
+def find_dvf_file(annee):
+    """Chemin d'un fichier texte DVF déjà extrait dans data/dvf_AAAA (ou None)."""
+    extract_path = os.path.join(zip_folder, f"dvf_{annee}")
+    if not os.path.isdir(extract_path):
+        return None
+    files = [f for f in os.listdir(extract_path) if f.endswith(".txt")]
+    if not files:
+        return None
+    return os.path.join(extract_path, files[0])
+
+
+def dvf_source(annee):
+    """Source DVF d'une année : l'archive ZIP si elle existe, sinon le fichier texte extrait (ou None)."""
+    zip_path = dvf_zip_path(annee)
+    if os.path.exists(zip_path):
+        return zip_path
+    return find_dvf_file(annee)
+
+
+def open_dvf(source):
+    """Flux binaire d'une source DVF.
+
+    Pour une archive, le fichier .txt est décompressé à la volée, sans copie
+    sur disque.
+    """
+    if source.endswith(".zip"):
+        archive = zipfile.ZipFile(source)
+        member = next(name for name in archive.namelist() if name.endswith(".txt"))
+        return archive.open(member)
+    return open(source, "rb")
+
+
+def dvf_byte_ranges(file_path, n_parts):
+    """Découpe un fichier DVF en `n_parts` plages d'octets alignées sur des débuts de mutation.
+
+    La première plage commence après la ligne d'en-tête. Chaque coupure est
+    avancée jusqu'à une ligne dont la mutation diffère de la précédente : les
+    lignes d'une même mutation restent dans la même plage (dédoublonnage).
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        header = f.readline().rstrip(b"\r\n").split(b"|")
+        key_idx = [header.index(col.encode()) for col in dvf_mutation_cols]
+
+        def mutation_key(line):
+            fields = line.rstrip(b"\r\n").split(b"|")
+            return [fields[i] if i < len(fields) else b"" for i in key_idx]
+
+        offsets = [f.tell()]
+        for k in range(1, n_parts):
+            f.seek(max(offsets[-1], size * k // n_parts))
+            f.readline()
+            previous = mutation_key(f.readline())
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line or mutation_key(line) != previous:
+                    break
+            if position >= size:
+                break
+            offsets.append(position)
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if end > start]
+
+
+def iter_dvf_chunks(source, chunksize=dvf_chunksize, start=None, end=None, columns=()):
+    """Lit une source DVF (séparateur '|') par blocs de `chunksize` lignes.
+
+    `source` est une archive ZIP ou un fichier texte (voir dvf_source). Avec
+    `start`/`end`, seule la plage d'octets [start, end) d'un fichier texte est
+    lue (l'en-tête du fichier est recollé devant). `columns` : colonnes
+    facultatives (`dvf_lazy_columns`) lues en plus de `dvf_usecols`.
+    """
+    with open_dvf(source) as f:
+        if start is not None:
+            header = f.readline()
+            f.seek(start)
+            f = io.BytesIO(header + f.read(end - start))
+        # Nombres au format français (« 185000,00 ») convertis par le lecteur C
+        yield from pd.read_csv(
+            f,
             sep="|",
-            usecols=["Date mutation", "Valeur fonciere", "Code departement", "Code commune"],
-            low_memory=False
+            usecols=dvf_usecols + list(columns),
+            dtype={
+                "Date mutation": str,
+                "Code departement": "category",
+                "Code commune": "category",
+                "Type local": "category",
+            },
+            decimal=",",
+            thousands=" ",
+            chunksize=chunksize,
         )
 
-        df_temp["annee_fichier"] = annee
-        dvf_list.append(df_temp)
 
-    foncieres_all = pd.concat(dvf_list, ignore_index=True)
+def french_numbers(values):
+    """Colonne numérique DVF en float64.
 
-    foncieres_all["Date mutation"] = pd.to_datetime(
-        foncieres_all["Date mutation"], format="%d/%m/%Y", errors="coerce"
-    )
-    foncieres_all["annee"] = foncieres_all["Date mutation"].dt.year
+    Le lecteur CSV convertit directement les nombres français (decimal=",") ;
+    si une valeur mal formée a laissé la colonne en texte dans ce bloc, on
+    repasse par la conversion chaîne par chaîne.
+    """
+    if values.dtype != object:
+        return values.astype(np.float64)
+    values = values.astype(str).str.replace(",", ".", regex=False).str.replace(" ", "", regex=False)
+    return pd.to_numeric(values, errors="coerce")
 
-    def format_code_dept(code):
-        code = str(code).strip()
-        if code.isdigit() and len(code) < 3:
-            return code.zfill(2)
-        return code
 
-    foncieres_all["Code departement"] = foncieres_all["Code departement"].apply(format_code_dept)
+def clean_dvf_chunk(chunk, annee):
+    """Parse, filtre et encode un bloc DVF.
 
-    foncieres_all["Valeur fonciere"] = (
-        foncieres_all["Valeur fonciere"]
-        .astype(str)
-        .str.replace(",", ".", regex=False)
-        .str.replace(" ", "", regex=False)
-    )
-    foncieres_all["Valeur fonciere"] = pd.to_numeric(foncieres_all["Valeur fonciere"], errors="coerce")
+    Colonnes produites : `Valeur fonciere` (float32), `Code departement`
+    (catégorie), `code_insee` (clé int32), `annee` et `annee_fichier` (int16),
+    `mois` (int8), puis les colonnes facultatives présentes dans le bloc
+    (déjà agrégées par `collapse_mutations`).
+    """
+    dates = pd.to_datetime(chunk["Date mutation"], format="%d/%m/%Y", errors="coerce")
+    valeurs = french_numbers(chunk["Valeur fonciere"])
 
-    foncieres_all = foncieres_all[
-        (foncieres_all["Valeur fonciere"].notna()) &
-        (foncieres_all["Valeur fonciere"] > 0) &
-        (foncieres_all["annee"].notna())
-    ]
+    keep = (valeurs.notna() & (valeurs > 0) & dates.notna()).to_numpy()
+
+    dept = encode_dept(chunk["Code departement"])
+    code_insee = insee_key(dept, chunk["Code commune"])
+
+    cleaned = pd.DataFrame({
+        "Valeur fonciere": valeurs.to_numpy(dtype=np.float32)[keep],
+        "Code departement": dept[keep],
+        "code_insee": code_insee[keep],
+        "annee": dates.dt.year.to_numpy()[keep].astype(np.int16),
+        "mois": dates.dt.month.to_numpy()[keep].astype(np.int8),
+        "annee_fichier": np.full(int(keep.sum()), annee, dtype=np.int16),
+    })
+    if "Surface reelle bati" in chunk.columns:
+        cleaned["Surface reelle bati"] = chunk["Surface reelle bati"].to_numpy(dtype=np.float32)[keep]
+    if "Type local" in chunk.columns:
+        cleaned["Type local"] = pd.Categorical(chunk["Type local"], dtype=type_local_dtype)[keep]
+    return cleaned
+
+
+def empty_dvf_frame(columns=()):
+    """Transactions vides avec les colonnes et types produits par clean_dvf_chunk."""
+    raw = pd.DataFrame({col: pd.Series([], dtype=object) for col in dvf_usecols + list(columns)})
+    for col in ("Code departement", "Code commune", "Type local"):
+        if col in raw.columns:
+            raw[col] = raw[col].astype("category")
+    raw["Valeur fonciere"] = raw["Valeur fonciere"].astype(np.float64)
+    if "Surface reelle bati" in raw.columns:
+        raw["Surface reelle bati"] = raw["Surface reelle bati"].astype(np.float64)
+    return clean_dvf_chunk(raw, 0)
+
+
+def mutation_hashes(chunk):
+    """Empreinte 64 bits de chaque ligne calculée sur `dvf_mutation_cols`."""
+    return pd.util.hash_pandas_object(chunk[dvf_mutation_cols], index=False).to_numpy()
 
-    # -----------------------------
-    # POPULATION COMMUNES
-    # -----------------------------
-    pop_communes_file = os.path.join(
-        zip_folder, "pop_communes", "base-pop-historiques-1876-2023.xlsx"
-    )
 
-    df_pop = pd.read_excel(pop_communes_file, sheet_name="pop_1876_2023", header=5)
+def collapse_mutations(chunk, keys):
+    """Ne garde qu'une ligne par mutation (même date, valeur, département et commune).
+
+    Les lignes d'une mutation (une par lot) se suivent dans le fichier :
+    chaque suite de lignes consécutives de même empreinte `keys` est réduite
+    à sa première ligne. Les colonnes facultatives sont agrégées sur la suite.
+    Renvoie le bloc réduit et le nombre de lignes retirées.
+    """
+    if len(chunk) == 0:
+        return chunk, 0
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    collapsed = chunk.iloc[starts].reset_index(drop=True)
+
+    if "Surface reelle bati" in chunk.columns:
+        surface = french_numbers(chunk["Surface reelle bati"]).to_numpy(dtype=np.float64)
+        known = ~np.isnan(surface)
+        total = np.add.reduceat(np.where(known, surface, 0.0), starts)
+        n_known = np.add.reduceat(known.astype(np.int64), starts)
+        collapsed["Surface reelle bati"] = np.where(n_known > 0, total, np.nan)
+
+    if "Type local" in chunk.columns:
+        # Type principal : plus petit code de TYPES_LOCAL (lot sans local = dernier)
+        codes = pd.Categorical(chunk["Type local"], dtype=type_local_dtype).codes.astype(np.int16)
+        codes[codes < 0] = len(TYPES_LOCAL)
+        main = np.minimum.reduceat(codes, starts)
+        main[main == len(TYPES_LOCAL)] = -1
+        collapsed["Type local"] = pd.Categorical.from_codes(main, dtype=type_local_dtype)
+
+    return collapsed, len(chunk) - len(starts)
+
+
+def iter_mutations(chunks):
+    """Réduit une suite de blocs DVF à une ligne par mutation.
+
+    La dernière mutation d'un bloc peut continuer dans le bloc suivant : ses
+    lignes sont mises de côté et traitées avec le début du bloc suivant, si
+    bien que le résultat ne dépend pas du découpage en blocs. Produit, pour
+    chaque bloc lu, (morceaux réduits, lignes lues, lignes retirées).
+    """
+    pending = None  # (lignes, empreintes) de la mutation en attente
+    for chunk in chunks:
+        n_lues = len(chunk)
+        keys = mutation_hashes(chunk)
+        pieces = []
+        n_retirees = 0
+        if pending is not None:
+            other = np.flatnonzero(keys != pending[1][-1])
+            head = int(other[0]) if len(other) else len(keys)
+            if head > 0:
+                # Colonne par colonne : pd.concat avertit (FutureWarning) dès
+                # qu'une colonne facultative est entièrement vide d'un côté
+                rows = {
+                    col: np.concatenate([pending[0][col].to_numpy(), chunk[col].to_numpy()[:head]])
+                    for col in chunk.columns
+                }
+                pending = (pd.DataFrame(rows, columns=chunk.columns), np.r_[pending[1], keys[:head]])
+            chunk, keys = chunk.iloc[head:], keys[head:]
+            if len(chunk) == 0:
+                yield pieces, n_lues, n_retirees
+                continue
+            piece, n_retirees = collapse_mutations(*pending)
+            pieces.append(piece)
+
+        tail = int(np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])[-1])
+        pending = (chunk.iloc[tail:], keys[tail:])
+        piece, n_dup = collapse_mutations(chunk.iloc[:tail], keys[:tail])
+        pieces.append(piece)
+        yield pieces, n_lues, n_retirees + n_dup
+
+    if pending is not None:
+        piece, n_dup = collapse_mutations(*pending)
+        yield [piece], 0, n_dup
+
+
+def _load_malloc_trim():
+    try:
+        return ctypes.CDLL("libc.so.6").malloc_trim
+    except (OSError, AttributeError):
+        return None
+
+
+_malloc_trim = _load_malloc_trim()
+
+
+def release_memory():
+    """Rend au système la mémoire libérée que glibc garde dans son tas (sans effet ailleurs)."""
+    if _malloc_trim is not None:
+        _malloc_trim(0)
+
+
+class ColumnStore:
+    """Stockage colonne par colonne des blocs nettoyés.
+
+    Chaque bloc est découpé en colonnes dès son ajout ; la concaténation finale
+    se fait colonne par colonne en libérant les morceaux au fur et à mesure,
+    et le DataFrame est construit sur les colonnes concaténées sans les
+    recopier : le pic mémoire dépasse la taille du jeu final d'environ une
+    colonne (celle en cours de concaténation).
+    """
+
+    def __init__(self, empty=None):
+        # `empty` : frame vide renvoyé (avec ses types) si aucun bloc n'a été ajouté
+        self.columns = {}
+        self.n_rows = 0
+        self.empty = empty
+
+    def append(self, df, copy=True):
+        # Les colonnes d'un bloc lu partagent souvent un même tableau 2D, qui ne
+        # serait libéré qu'avec la dernière : chaque colonne est recopiée (à la
+        # taille d'un bloc). Inutile pour un frame issu de to_frame().
+        for col in df.columns:
+            self.columns.setdefault(col, []).append(df[col].copy() if copy else df[col])
+        self.n_rows += len(df)
+
+    def to_frame(self):
+        if not self.columns and self.empty is not None:
+            return self.empty.copy()
+        data = {}
+        for col in list(self.columns):
+            parts = self.columns.pop(col)
+            if len(parts) == 1:
+                # Un seul morceau : repris tel quel
+                data[col] = parts[0].reset_index(drop=True)
+            else:
+                data[col] = pd.concat(parts, ignore_index=True)
+            del parts
+            release_memory()
+        self.n_rows = 0
+        # copy=False : pour un dict, pandas recopie sinon chaque colonne
+        return pd.DataFrame(data, copy=False)
+
+
+def parse_dvf_part(annee, source, start=None, end=None, chunksize=dvf_chunksize, columns=()):
+    """Lit et nettoie une source DVF annuelle (ou une plage d'octets de son fichier texte).
+
+    Exécuté dans le processus courant ou dans un worker du pool ; le débit de
+    chaque bloc est affiché. Renvoie les transactions (une ligne par mutation)
+    et le nombre de lignes retirées comme doublons.
+    """
+    store = ColumnStore(empty=empty_dvf_frame(columns))
+    label = f"DVF {annee}" if start is None else f"DVF {annee} [{start:,}-{end:,}]"
+    debut_part = time.perf_counter()
+    n_lues = 0
+    n_doublons = 0
+    debut = time.perf_counter()
+    chunks = iter_dvf_chunks(source, chunksize, start, end, columns)
+    for i, (pieces, n_bloc, n_dup) in enumerate(iter_mutations(chunks)):
+        n_gardees = 0
+        for piece in pieces:
+            piece = clean_dvf_chunk(piece, annee)
+            store.append(piece)
+            n_gardees += len(piece)
+        duree = max(time.perf_counter() - debut, 1e-9)
+        n_lues += n_bloc
+        n_doublons += n_dup
+        print(
+            f"  {label} bloc {i} : {n_bloc:,} lignes lues, {n_dup:,} doublons, {n_gardees:,} gardées "
+            f"en {duree:.2f}s ({n_bloc / duree:,.0f} lignes/s)"
+        )
+        debut = time.perf_counter()
+
+    duree_part = max(time.perf_counter() - debut_part, 1e-9)
+    print(f"✓ {label} : {n_lues:,} lignes en {duree_part:.1f}s ({n_lues / duree_part:,.0f} lignes/s)")
+    return store.to_frame(), n_doublons
+
+
+def _parse_dvf_task(task):
+    annee, source, start, end, chunksize, columns = task
+    return parse_dvf_part(annee, source, start, end, chunksize, columns)
+
+
+def load_dvf(chunksize=dvf_chunksize, years=None, workers=None, splits_per_year=None, columns=()):
+    """Charge les fichiers DVF annuels en streaming.
+
+    Chaque fichier est lu par blocs de `chunksize` lignes, directement dans
+    son archive ZIP ; chaque bloc est dédoublonné (une ligne par mutation),
+    nettoyé et filtré puis ajouté au `ColumnStore`. `columns` : colonnes
+    facultatives à lire en plus (`dvf_lazy_columns`). Les archives sont
+    décompressées en parallèle sur un pool de `workers` processus ; pour un
+    fichier déjà extrait, `splits_per_year` > 1 le découpe en plages
+    d'octets. Les résultats sont assemblés dans l'ordre année puis plage,
+    quel que soit l'ordre de fin des workers.
+    """
+    workers = dvf_workers if workers is None else workers
+    splits_per_year = dvf_splits_per_year if splits_per_year is None else splits_per_year
+
+    tasks = []
+    for annee in (dvf_years() if years is None else years):
+        source = dvf_source(annee)
+        if source is None:
+            continue
+        # Un flux décompressé ne se découpe pas : une tâche par archive
+        if splits_per_year > 1 and not source.endswith(".zip"):
+            for start, end in dvf_byte_ranges(source, splits_per_year):
+                tasks.append((annee, source, start, end, chunksize, tuple(columns)))
+        else:
+            tasks.append((annee, source, None, None, chunksize, tuple(columns)))
+
+    store = ColumnStore(empty=empty_dvf_frame(columns))
+    doublons = {}
+    if workers <= 1 or len(tasks) <= 1:
+        results = map(_parse_dvf_task, tasks)
+        for task, (frame, n_doublons) in zip(tasks, results):
+            store.append(frame, copy=False)
+            doublons[task[0]] = doublons.get(task[0], 0) + n_doublons
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            # map() rend les résultats dans l'ordre des tâches : assemblage déterministe
+            for task, (frame, n_doublons) in zip(tasks, executor.map(_parse_dvf_task, tasks)):
+                store.append(frame, copy=False)
+                doublons[task[0]] = doublons.get(task[0], 0) + n_doublons
+
+    for annee, n_doublons in doublons.items():
+        print(f"✓ DVF {annee} : {n_doublons:,} lignes en double retirées (une ligne par mutation)")
+    return store.to_frame()
+
+
+# =============================
+# POPULATION
+# =============================
+# Les classeurs INSEE sont ouverts une seule fois, en lecture seule
+# (streaming des lignes par openpyxl), en ne gardant que les feuilles et
+# colonnes utiles. Le résultat normalisé est mis en cache en Parquet dans
+# data/cache/xlsx/, sous une clé dérivée du hash du classeur.
+xlsx_cache_dir = os.path.join(data_store.store_dir, "xlsx")
+
+
+def cached_workbook_frame(name, path, build):
+    """`build(path)` mis en cache en Parquet, recalculé seulement si le classeur change."""
+    key = f"{name}-v{data_store.STORE_VERSION}-{data_store.file_sha256(path)[:16]}"
+    cache_path = os.path.join(xlsx_cache_dir, f"{key}.parquet")
+    if os.path.exists(cache_path):
+        print(f"✓ {name} : lu depuis le cache ({os.path.basename(cache_path)})")
+        return pd.read_parquet(cache_path)
+
+    df = build(path)
+    os.makedirs(xlsx_cache_dir, exist_ok=True)
+    data_store.write_frame(df, cache_path)
+    for old in os.listdir(xlsx_cache_dir):
+        if old.startswith(f"{name}-") and old != os.path.basename(cache_path):
+            os.remove(os.path.join(xlsx_cache_dir, old))
+    return df
+
+
+def iter_sheet_rows(sheet, min_row=1):
+    """Valeurs des lignes d'une feuille, comme pandas : cellules vides en NaN,
+    lignes vides finales omises, entiers restaurés."""
+    blank = []
+    for row in sheet.iter_rows(min_row=min_row, values_only=True):
+        if all(v is None for v in row):
+            blank.append(row)
+            continue
+        yield from (tuple(np.nan for _ in r) for r in blank)
+        blank = []
+        yield tuple(
+            np.nan if v is None else int(v) if isinstance(v, float) and v.is_integer() else v
+            for v in row
+        )
+
+
+def read_sheet_columns(sheet, header_row, columns):
+    """Colonnes `columns` d'une feuille dont l'en-tête est à la ligne `header_row` (base 1)."""
+    rows = iter_sheet_rows(sheet, min_row=header_row)
+    header = [str(v) for v in next(rows)]
+    idx = [header.index(col) for col in columns]
+    data = [[row[i] if i < len(row) else np.nan for i in idx] for row in rows]
+    return pd.DataFrame(data, columns=columns)
+
+
+def parse_pop_communes(pop_communes_file):
+    import openpyxl
 
     colonnes_a_garder = ["CODGEO", "REG", "DEP", "LIBGEO", "PMUN2020", "PMUN2021", "PMUN2022", "PMUN2023"]
 
-    pop_communes = df_pop[colonnes_a_garder].copy()
+    workbook = openpyxl.load_workbook(pop_communes_file, read_only=True, data_only=True)
+    try:
+        pop_communes = read_sheet_columns(workbook["pop_1876_2023"], 6, colonnes_a_garder)
+    finally:
+        workbook.close()
+
     pop_communes.columns = [
         "code_commune", "code_region", "code_departement", "nom_commune",
         "pop_2020", "pop_2021", "pop_2022", "pop_2023"
@@ -111,70 +629,89 @@ def load_all_data():
 
     pop_communes["code_departement"] = pop_communes["code_departement"].astype(str).str.zfill(2)
 
-    # -----------------------------
-    # POPULATION DÉPARTEMENTS (AVEC TRANCHES D'ÂGE)
-    # -----------------------------
-    pop_dep_file = os.path.join(zip_folder, "pop_departement", "estim-pop-dep-sexe-gca-1975-2026.xlsx")
+    return pop_communes
+
+
+def load_pop_communes():
+    pop_communes_file = os.path.join(
+        zip_folder, "pop_communes", "base-pop-historiques-1876-2023.xlsx"
+    )
+    return cached_workbook_frame("pop_communes", pop_communes_file, parse_pop_communes)
+
+
+def pop_dep_columns(top, sub):
+    """Noms des colonnes d'une feuille annuelle à partir de ses deux lignes d'en-tête.
+
+    Le niveau supérieur (cellules fusionnées) est propagé vers la droite.
+    """
+    new_cols = []
+    dept_count = 0
+    lvl0 = ""
+    for cell0, cell1 in zip(top, sub):
+        if pd.notna(cell0):
+            lvl0 = str(cell0).strip()
+        lvl1 = str(cell1).strip() if pd.notna(cell1) else ""
+
+        if "Départements" in lvl0 and not lvl1:
+            if dept_count == 0:
+                new_cols.append("Code_departement")
+                dept_count += 1
+            else:
+                new_cols.append("Nom_departement")
+        elif "Ensemble" in lvl0 and "Total" in lvl1:
+            new_cols.append("Ensemble_Total")
+        elif "Ensemble" in lvl0 and lvl1:
+            # Nettoyer le nom de la tranche d'âge
+            new_cols.append(f"Ensemble_{lvl1}")
+        else:
+            new_cols.append(f"{lvl0}_{lvl1}" if lvl1 else lvl0)
+    return new_cols
+
+
+def parse_pop_dep(pop_dep_file):
+    import openpyxl
 
     pop_dep_all = []
 
-    for annee in range(2020, 2027):
-        try:
-            df = pd.read_excel(pop_dep_file, sheet_name=str(annee), header=[3, 4])
-
-            # Aplatir les colonnes multi-index
-            new_cols = []
-            dept_count = 0
-
-            for col in df.columns:
-                if isinstance(col, tuple):
-                    lvl0 = str(col[0]).strip()
-                    lvl1 = str(col[1]).strip()
-
-                    if "Départements" in lvl0 and "Unnamed" in lvl1:
-                        if dept_count == 0:
-                            new_cols.append("Code_departement")
-                            dept_count += 1
-                        else:
-                            new_cols.append("Nom_departement")
-                    elif "Ensemble" in lvl0 and "Total" in lvl1:
-                        new_cols.append("Ensemble_Total")
-                    elif "Ensemble" in lvl0 and lvl1 and lvl1 != "nan":
-                        # Nettoyer le nom de la tranche d'âge
-                        age_range = lvl1.strip()
-                        new_cols.append(f"Ensemble_{age_range}")
-                    else:
-                        new_cols.append(f"{lvl0}_{lvl1}" if lvl1 != "nan" else lvl0)
-                else:
-                    new_cols.append(str(col))
+    workbook = openpyxl.load_workbook(pop_dep_file, read_only=True, data_only=True)
+    try:
+        for annee in range(2020, 2027):
+            try:
+                # En-tête sur deux lignes (4 et 5), données à partir de la ligne 6
+                rows = iter_sheet_rows(workbook[str(annee)], min_row=4)
+                new_cols = pop_dep_columns(next(rows), next(rows))
+
+                # Colonnes à garder
+                cols_to_keep = ["Code_departement", "Nom_departement", "Ensemble_Total"]
 
-            df.columns = new_cols
+                # Chercher toutes les colonnes qui contiennent "Ensemble_" et une tranche d'âge
+                for col in new_cols:
+                    if "Ensemble_" in col and col != "Ensemble_Total":
+                        # Vérifier si c'est une tranche d'âge
+                        if any(x in col for x in ["ans", "plus"]):
+                            cols_to_keep.append(col)
 
-            df["Code_departement"] = df["Code_departement"].astype(str).str.strip()
+                # Garder uniquement les colonnes qui existent
+                cols_existantes = [c for c in cols_to_keep if c in new_cols]
+                idx = [new_cols.index(c) for c in cols_existantes]
+                df = pd.DataFrame(
+                    [[row[i] if i < len(row) else np.nan for i in idx] for row in rows],
+                    columns=cols_existantes,
+                )
 
-            # Colonnes à garder
-            cols_to_keep = ["Code_departement", "Nom_departement", "Ensemble_Total"]
-            
-            # Chercher toutes les colonnes qui contiennent "Ensemble_" et une tranche d'âge
-            for col in df.columns:
-                if "Ensemble_" in col and col != "Ensemble_Total":
-                    # Vérifier si c'est une tranche d'âge
-                    if any(x in col for x in ["ans", "plus"]):
-                        cols_to_keep.append(col)
-            
-            # Garder uniquement les colonnes qui existent
-            cols_existantes = [c for c in cols_to_keep if c in df.columns]
-            df = df[cols_existantes].copy()
-            df["annee"] = annee
+                df["Code_departement"] = df["Code_departement"].astype(str).str.strip()
+                df["annee"] = annee
 
-            pop_dep_all.append(df)
+                pop_dep_all.append(df)
 
-            print(f"✓ Population département {annee} : {len(cols_existantes)-2} colonnes ({', '.join([c for c in cols_existantes if 'Ensemble_' in c])})")
+                print(f"✓ Population département {annee} : {len(cols_existantes)-2} colonnes ({', '.join([c for c in cols_existantes if 'Ensemble_' in c])})")
 
-        except Exception as e:
-            print(f"⚠ Erreur année {annee}: {e}")
-            import traceback
-            traceback.print_exc()
+            except Exception as e:
+                print(f"⚠ Erreur année {annee}: {e}")
+                import traceback
+                traceback.print_exc()
+    finally:
+        workbook.close()
 
     pop_dep_all = pd.concat(pop_dep_all, ignore_index=True)
 
@@ -182,22 +719,674 @@ def load_all_data():
     for col in pop_dep_all.columns:
         if "Ensemble" in col:
             pop_dep_all[col] = pd.to_numeric(pop_dep_all[col], errors="coerce")
-    
+
+    return pop_dep_all
+
+
+def load_pop_dep():
+    pop_dep_file = os.path.join(zip_folder, "pop_departement", "estim-pop-dep-sexe-gca-1975-2026.xlsx")
+
+    pop_dep_all = cached_workbook_frame("pop_dep_all", pop_dep_file, parse_pop_dep)
+
     print(f"\n📊 Colonnes finales dans pop_dep_all:")
     print(pop_dep_all.columns.tolist())
     print(f"\n📈 Exemple de données:")
     print(pop_dep_all.head())
 
-    # -----------------------------
-    # CACHE
-    # -----------------------------
-    data = {
-        "foncieres_all": foncieres_all,
-        "pop_communes": pop_communes,
-        "pop_dep_all": pop_dep_all
+    return pop_dep_all
+
+
+# =============================
+# CENTROÏDES DES COMMUNES
+# =============================
+# Fichier « Communes et villes de France » de data.gouv.fr (voir README),
+# à déposer dans data/ : seules la clé INSEE, le nom et les coordonnées du
+# centre de la commune sont gardés.
+def communes_geo_file():
+    """Chemin du CSV des communes (le plus récent si plusieurs), ou None."""
+    files = sorted(f for f in os.listdir(zip_folder) if re.fullmatch(r"communes-france.*\.csv", f))
+    return os.path.join(zip_folder, files[-1]) if files else None
+
+
+def load_commune_centroids():
+    path = communes_geo_file()
+    if path is None:
+        print("⚠ Fichier communes-france*.csv absent : carte communale sans coordonnées")
+        return pd.DataFrame({
+            "code_insee": np.array([], dtype=np.int32),
+            "nom_commune": pd.Series([], dtype=str),
+            "latitude": np.array([], dtype=np.float32),
+            "longitude": np.array([], dtype=np.float32),
+        })
+
+    header = pd.read_csv(path, nrows=0).columns
+
+    def first(*names):
+        return next(n for n in names if n in header)
+
+    nom = first("nom_standard", "nom_commune_complet", "nom_commune")
+    lat = first("latitude_centre", "latitude_mairie", "latitude")
+    lon = first("longitude_centre", "longitude_mairie", "longitude")
+    df = pd.read_csv(path, usecols=["code_insee", nom, lat, lon], dtype={"code_insee": str})
+
+    centroids = pd.DataFrame({
+        "code_insee": insee_key_from_code(df["code_insee"]),
+        "nom_commune": df[nom],
+        "latitude": pd.to_numeric(df[lat], errors="coerce").astype(np.float32),
+        "longitude": pd.to_numeric(df[lon], errors="coerce").astype(np.float32),
+    })
+    centroids = centroids[(centroids["code_insee"] >= 0) & centroids["latitude"].notna()]
+    return centroids.drop_duplicates("code_insee").reset_index(drop=True)
+
+
+# =============================
+# DIMENSION COMMUNE
+# =============================
+# Table construite à l'ingestion (jeu "communes") : chaque commune vue dans
+# DVF (clé entière code_insee) est rattachée à sa ligne de population INSEE
+# (clé entière code_pop, -1 si aucune) :
+#   - arrondissements municipaux de Paris, Lyon et Marseille → commune ;
+#   - anciennes communes fusionnées → commune nouvelle, d'après le fichier
+#     des mouvements du COG de l'INSEE (v_mvt_commune_AAAA.csv), à déposer
+#     dans data/ (facultatif).
+PLM_ARRONDISSEMENTS = {
+    75056: range(75101, 75121),  # Paris
+    69123: range(69381, 69390),  # Lyon
+    13055: range(13201, 13217),  # Marseille
+}
+# Codes MOD du COG : fusion simple, création de commune nouvelle, fusion-association
+MOUVEMENTS_FUSION = {"31", "32", "33", "34"}
+
+
+def commune_moves_file():
+    """Chemin du fichier des mouvements de communes (le plus récent), ou None."""
+    files = sorted(f for f in os.listdir(zip_folder) if re.fullmatch(r"v_mvt_commune_.*\.csv", f))
+    return os.path.join(zip_folder, files[-1]) if files else None
+
+
+def load_commune_merges():
+    """Ancienne commune → commune qui l'a absorbée (clés entières)."""
+    path = commune_moves_file()
+    if path is None:
+        print("⚠ Fichier v_mvt_commune_*.csv absent : communes fusionnées non rattachées")
+        return {}
+    mvt = pd.read_csv(path, dtype=str, usecols=["MOD", "TYPECOM_AV", "COM_AV", "TYPECOM_AP", "COM_AP"])
+    fusions = mvt[
+        mvt["MOD"].isin(MOUVEMENTS_FUSION)
+        & (mvt["TYPECOM_AV"] == "COM")
+        & (mvt["TYPECOM_AP"] == "COM")
+        & (mvt["COM_AV"] != mvt["COM_AP"])
+    ]
+    return dict(zip(insee_key_from_code(fusions["COM_AV"]), insee_key_from_code(fusions["COM_AP"])))
+
+
+def commune_population(pop_communes):
+    """Population communale au format long : code_pop, annee, population."""
+    annees_pop = sorted(int(c[4:]) for c in pop_communes.columns if re.fullmatch(r"pop_\d{4}", c))
+    keys = insee_key_from_code(pop_communes["code_commune"])
+    population = pd.DataFrame({
+        "code_pop": np.tile(keys, len(annees_pop)),
+        "annee": np.repeat(np.array(annees_pop, dtype=np.int64), len(keys)),
+        "population": np.concatenate(
+            [pd.to_numeric(pop_communes[f"pop_{a}"], errors="coerce").to_numpy() for a in annees_pop]
+        ) if annees_pop else np.array([]),
+    })
+    population = population[population["code_pop"] >= 0]
+    return population.drop_duplicates(["code_pop", "annee"]).reset_index(drop=True)
+
+
+def build_commune_panel(foncieres, dimension, pop_communes):
+    """Panel commune × année (clé code_pop) à partir des transactions."""
+    transactions = pd.DataFrame({
+        "code_pop": population_keys(foncieres["code_insee"].to_numpy(), dimension),
+        "annee": foncieres["annee"].to_numpy(),
+        "Valeur fonciere": foncieres["Valeur fonciere"].to_numpy(),
+    })
+    return aggregations.commune_panel(transactions, commune_population(pop_communes))
+
+
+def build_commune_dimension(codes_dvf, pop_communes):
+    """Table code_insee → code_pop (ligne de population) et nom de la commune."""
+    pop_keys = insee_key_from_code(pop_communes["code_commune"])
+    noms = pd.Series(pop_communes["nom_commune"].to_numpy(), index=pop_keys)
+    noms = noms[~noms.index.duplicated()]
+
+    parents = load_commune_merges()
+    for commune, arrondissements in PLM_ARRONDISSEMENTS.items():
+        parents.update({code: commune for code in arrondissements})
+
+    codes = np.union1d(np.asarray(codes_dvf), pop_keys)
+    codes = codes[codes >= 0].astype(np.int32)
+
+    # Fusions en cascade : on remonte jusqu'à une commune sans parent
+    cible = pd.Series(codes)
+    for _ in range(10):
+        suivante = cible.map(parents).fillna(cible).astype(np.int32)
+        if suivante.equals(cible):
+            break
+        cible = suivante
+    cible = cible.to_numpy()
+    # Commune elle-même présente dans la population : pas de rattachement
+    cible = np.where(np.isin(codes, pop_keys), codes, cible)
+
+    code_pop = np.where(np.isin(cible, pop_keys), cible, -1).astype(np.int32)
+    dimension = pd.DataFrame({
+        "code_insee": codes,
+        "code_pop": code_pop,
+        "nom_commune": noms.reindex(code_pop).to_numpy(),
+    })
+    n_rattachees = int(((code_pop >= 0) & (code_pop != codes)).sum())
+    print(
+        f"✓ Dimension commune : {len(dimension):,} communes, {n_rattachees:,} rattachées "
+        f"(arrondissements, fusions), {int((code_pop < 0).sum()):,} sans population"
+    )
+    return dimension
+
+
+# =============================
+# CACHE ET CHARGEMENT DES DONNÉES
+# =============================
+def source_files():
+    """Fichiers sources (ZIP et XLSX) dont dépend le cache."""
+    paths = [dvf_zip_path(annee) for annee in dvf_years()]
+    paths += [
+        os.path.join(zip_folder, "base-pop-historiques-1876-2023.zip"),
+        os.path.join(zip_folder, "pop_communes", "base-pop-historiques-1876-2023.xlsx"),
+        os.path.join(zip_folder, "estim-pop-dep-sexe-gca-1975-2026.zip"),
+        os.path.join(zip_folder, "pop_departement", "estim-pop-dep-sexe-gca-1975-2026.xlsx"),
+    ]
+    if communes_geo_file() is not None:
+        paths.append(communes_geo_file())
+    if commune_moves_file() is not None:
+        paths.append(commune_moves_file())
+    return paths
+
+
+def build_cache():
+    """Reconstruit entièrement le cache Parquet à partir des fichiers sources."""
+    previous = data_store.read_manifest()
+    fingerprint = data_store.source_fingerprint(
+        source_files(), previous=previous["sources"] if previous else None
+    )
+
+    # Les colonnes facultatives déjà demandées restent dans le cache reconstruit
+    lazy_columns = previous["datasets"]["foncieres_all"].get("lazy_columns", []) if previous else []
+
+    pop_dep_all = load_pop_dep()
+    pop_communes = load_pop_communes()
+    foncieres_all = load_dvf(chunksize=dvf_chunksize, columns=lazy_columns)
+    dimension = build_commune_dimension(np.unique(foncieres_all["code_insee"].to_numpy()), pop_communes)
+    # Tables par année et cube temporel (mois, trimestre) : un seul tri par niveau
+    dep_annee, cube_departement, cube_departement_sketches = aggregations.department_stats(foncieres_all)
+    commune_annee, cube_commune, cube_commune_sketches = aggregations.commune_stats(foncieres_all)
+    datasets = {
+        "foncieres_all": data_store.write_dataset(
+            "foncieres_all", foncieres_all, partition_col="annee_fichier", lazy_columns=lazy_columns
+        ),
+        # Table département × année partagée par les pages
+        "dep_annee": data_store.write_dataset("dep_annee", aggregations.join_pop_dep(dep_annee, pop_dep_all)),
+        "commune_annee": data_store.write_dataset("commune_annee", commune_annee, partition_col="annee"),
+        # Cube temporel par département et par commune, avec le sketch de chaque cellule
+        "cube_departement": data_store.write_dataset("cube_departement", cube_departement, partition_col="annee"),
+        "cube_departement_sketches": data_store.write_dataset(
+            "cube_departement_sketches", cube_departement_sketches, partition_col="annee"
+        ),
+        "cube_commune": data_store.write_dataset("cube_commune", cube_commune, partition_col="annee"),
+        "cube_commune_sketches": data_store.write_dataset(
+            "cube_commune_sketches", cube_commune_sketches, partition_col="annee"
+        ),
+        # Sketches de quantiles par département × commune × année × mois (fusionnables)
+        "sketches": data_store.write_dataset(
+            "sketches", sketches.build_sketches(foncieres_all), partition_col="annee"
+        ),
+        # Panel commune × année sur la clé de population (toutes les communes)
+        "panel_communes": data_store.write_dataset(
+            "panel_communes", build_commune_panel(foncieres_all, dimension, pop_communes), partition_col="annee"
+        ),
+    }
+    del foncieres_all
+
+    datasets["pop_communes"] = data_store.write_dataset("pop_communes", pop_communes)
+    datasets["communes"] = data_store.write_dataset("communes", dimension)
+    datasets["communes_geo"] = data_store.write_dataset("communes_geo", load_commune_centroids())
+    datasets["pop_dep_all"] = data_store.write_dataset("pop_dep_all", pop_dep_all, partition_col="annee")
+
+    manifest = {
+        "store_version": data_store.STORE_VERSION,
+        "version": data_store.fingerprint_version(fingerprint),
+        "sources": fingerprint,
+        "datasets": datasets,
     }
+    data_store.write_manifest(manifest)
+    return manifest
+
+
+def update_cache():
+    """Met à jour le cache en ne relisant que les archives nouvelles ou modifiées.
+
+    - une archive ValeursFoncieres-AAAA.zip nouvelle ou modifiée est relue
+      (sans extraction) et seule sa partition annee_fichier=AAAA est réécrite ;
+      si l'archive est supprimée et qu'aucune autre source de l'année ne
+      subsiste, les partitions de l'année sont supprimées de chaque table ;
+    - la table département × année n'est recalculée que pour les années
+      concernées (on suppose qu'un fichier annuel ne contient que les
+      mutations de son année) ;
+    - la table commune × année, le cube temporel (et ses sketches) et les
+      sketches de quantiles sont réécrits pour les mêmes années ;
+    - un fichier de population modifié est relu et rejoint à la table.
+    Sans manifeste valide (premier lancement, changement de format), le
+    cache est reconstruit entièrement.
+    """
+    manifest = data_store.read_manifest()
+    if manifest is None:
+        print("⚠ Cache absent : construction complète...")
+        return build_cache()
+
+    old_sources = manifest["sources"]
+    fingerprint = data_store.source_fingerprint(source_files(), previous=old_sources)
+    version = data_store.fingerprint_version(fingerprint)
+    if version == manifest["version"]:
+        if fingerprint != old_sources:
+            manifest["sources"] = fingerprint
+            data_store.write_manifest(manifest)
+        return manifest
+
+    changed = {
+        path for path, info in fingerprint.items()
+        if old_sources.get(path, {}).get("sha256") != info["sha256"]
+    }
+    # Fichier source supprimé (ex. CSV des communes ou archive DVF retirés)
+    changed |= set(old_sources) - set(fingerprint)
+    # Années DVF à relire : archive nouvelle, modifiée ou supprimée (l'année
+    # est prise dans le nom du fichier, même hors de dvf_years()), plus les
+    # partitions du cache dont aucune source ne subsiste. Une année sans
+    # source est relue à vide : ses partitions sont supprimées.
+    dvf_changed = {}
+    for path in changed:
+        match = re.fullmatch(r"ValeursFoncieres-(\d{4})\.zip", os.path.basename(path))
+        if match:
+            dvf_changed[path] = int(match.group(1))
+    partition_years = {int(k) for k in manifest["datasets"]["foncieres_all"]["partitions"]}
+    years = sorted(set(dvf_changed.values()) | {a for a in partition_years if dvf_source(a) is None})
+    pop_changed = any(path not in dvf_changed for path in changed)
+    print(f"⚠ Cache obsolète : mise à jour (années DVF {years}, population {'oui' if pop_changed else 'non'})")
+
+    datasets = dict(manifest["datasets"])
+
+    if pop_changed:
+        for zip_path, extract_path in pop_zips.items():
+            if zip_path in changed:
+                extract_zip(zip_path, extract_path, force=True)
+        pop_dep_all = load_pop_dep()
+        datasets["pop_communes"] = data_store.write_dataset("pop_communes", load_pop_communes())
+        datasets["pop_dep_all"] = data_store.write_dataset("pop_dep_all", pop_dep_all, partition_col="annee")
+        datasets["communes_geo"] = data_store.write_dataset("communes_geo", load_commune_centroids())
+    else:
+        pop_dep_all = data_store.read_dataset("pop_dep_all", manifest=manifest)
+
+    stats_years = []
+    if years:
+        foncieres_new = load_dvf(years=years, columns=datasets["foncieres_all"].get("lazy_columns", []))
+        stats_years = sorted(set(years) | set(int(a) for a in foncieres_new["annee"].unique()))
+        datasets["foncieres_all"] = data_store.replace_partitions(
+            datasets["foncieres_all"], "foncieres_all", foncieres_new, years
+        )
+        del foncieres_new
+
+    manifest = dict(manifest, datasets=datasets)
+    foncieres_years = data_store.read_dataset(
+        "foncieres_all",
+        columns=["Code departement", "code_insee", "annee", "mois", "Valeur fonciere"],
+        years=stats_years,
+        manifest=manifest,
+    )
+    dep_annee, cube_departement, cube_departement_sketches = aggregations.department_stats(foncieres_years)
+    commune_annee, cube_commune, cube_commune_sketches = aggregations.commune_stats(foncieres_years)
+    previous_stats = data_store.read_dataset("dep_annee", manifest=manifest)
+    datasets["dep_annee"] = data_store.write_dataset(
+        "dep_annee",
+        aggregations.update_dep_year_stats(previous_stats, dep_annee, stats_years, pop_dep_all),
+    )
+    for name, df in (
+        ("commune_annee", commune_annee),
+        ("cube_departement", cube_departement),
+        ("cube_departement_sketches", cube_departement_sketches),
+        ("cube_commune", cube_commune),
+        ("cube_commune_sketches", cube_commune_sketches),
+    ):
+        datasets[name] = data_store.replace_partitions(datasets[name], name, df, stats_years)
+    datasets["sketches"] = data_store.replace_partitions(
+        datasets["sketches"], "sketches", sketches.build_sketches(foncieres_years), stats_years,
+    )
+    # Dimension commune : communes de toutes les années (commune_annee) × population
+    codes_dvf = data_store.read_dataset("commune_annee", columns=["code_insee"], manifest=manifest)["code_insee"]
+    pop_communes = data_store.read_dataset("pop_communes", manifest=manifest)
+    dimension = build_commune_dimension(codes_dvf.unique(), pop_communes)
+    datasets["communes"] = data_store.write_dataset("communes", dimension)
+
+    # Panel commune × année : années relues, ou tout le panel si la population
+    # (donc la dimension) a changé
+    if pop_changed:
+        foncieres_panel = data_store.read_dataset(
+            "foncieres_all", columns=["code_insee", "annee", "Valeur fonciere"], manifest=manifest
+        )
+        datasets["panel_communes"] = data_store.write_dataset(
+            "panel_communes", build_commune_panel(foncieres_panel, dimension, pop_communes), partition_col="annee"
+        )
+        del foncieres_panel
+    else:
+        datasets["panel_communes"] = data_store.replace_partitions(
+            datasets["panel_communes"], "panel_communes",
+            build_commune_panel(foncieres_years, dimension, pop_communes), stats_years,
+        )
+
+    manifest = dict(manifest, version=version, sources=fingerprint, datasets=datasets)
+    data_store.write_manifest(manifest)
+    return manifest
 
-    with open(cache_file, "wb") as f:
-        pickle.dump(data, f)
 
-    return data
\ No newline at end of file
+def ensure_cache():
+    """Vérifie le cache (hash/mtime des sources) et le met à jour si besoin."""
+    with data_store.store_lock("build"):
+        return update_cache()
+
+
+def ensure_columns(columns):
+    """Ajoute au cache les colonnes facultatives de `columns` qui n'y sont pas encore.
+
+    Les fichiers DVF sont relus avec ces seules colonnes en plus de celles
+    nécessaires pour retrouver les mutations ; les lignes obtenues sont
+    vérifiées contre le cache puis chaque nouvelle colonne est écrite dans
+    son propre fichier, à côté des partitions existantes (inchangées).
+    """
+    manifest = ensure_cache()
+
+    def missing_columns(manifest):
+        present = manifest["datasets"]["foncieres_all"]["columns"]
+        return [c for c in dvf_lazy_columns if c in set(columns or ()) and c not in present]
+
+    if not missing_columns(manifest):
+        return manifest
+
+    with data_store.store_lock("build"):
+        manifest = data_store.read_manifest()
+        missing = missing_columns(manifest)
+        if not missing:
+            return manifest
+        entry = manifest["datasets"]["foncieres_all"]
+        years = sorted(int(k) for k in entry["partitions"])
+        print(f"Ajout des colonnes {missing} au cache (années {years})...")
+        foncieres = load_dvf(years=years, columns=missing)
+        entry = data_store.add_columns(
+            entry, "foncieres_all", foncieres, missing, check_cols=["Valeur fonciere", "code_insee", "annee"]
+        )
+        del foncieres
+        manifest["datasets"] = dict(manifest["datasets"], foncieres_all=entry)
+        data_store.write_manifest(manifest)
+        print(f"✓ Colonnes {missing} ajoutées au cache")
+    return manifest
+
+
+def prepare_shared_data():
+    """Matérialise foncieres_all en tableaux memmap s'ils n'existent pas encore.
+
+    Un seul processus fait le travail (verrou) ; les autres attendent puis
+    s'attachent aux fichiers déjà écrits.
+    """
+    manifest = ensure_cache()
+    key = shared_data_key(manifest)
+    with data_store.store_lock("shared"):
+        if not data_store.has_shared(key):
+            print("Matérialisation de foncieres_all en mémoire partagée...")
+            foncieres_all = data_store.read_dataset("foncieres_all", manifest=manifest)
+            data_store.materialize_shared(foncieres_all, key)
+    return manifest
+
+
+def shared_data_key(manifest):
+    """Clé memmap : version du cache et colonnes de foncieres_all (facultatives comprises)."""
+    return data_store.shared_key(manifest["version"], manifest["datasets"]["foncieres_all"]["columns"])
+
+
+# =============================
+# TRANSACTIONS EN LECTURE SEULE
+# =============================
+# foncieres_all est chargé une seule fois par processus et par version du
+# cache. Toutes les pages reçoivent des vues sur les mêmes tableaux, que
+# numpy refuse de modifier : une page ne peut pas changer les données vues
+# par une autre, et le résultat ne dépend plus de l'ordre d'import des pages.
+def _read_only(values):
+    values = np.asarray(values).view()
+    values.flags.writeable = False
+    return values
+
+
+class FoncieresDataset:
+    """Colonnes de foncieres_all en tableaux non modifiables.
+
+    Les colonnes catégorielles sont gardées sous forme de codes entiers et de
+    leur dtype ; `partition_rows` (manifeste) situe chaque partition annuelle.
+    """
+
+    def __init__(self, df, partition_rows=None):
+        self.arrays = {}
+        self.dtypes = {}
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                self.arrays[col] = _read_only(df[col].cat.codes)
+                self.dtypes[col] = df[col].dtype
+            else:
+                self.arrays[col] = _read_only(df[col])
+        self.columns = list(df.columns)
+        self.n_rows = len(df)
+
+        self.partitions = {}
+        start = 0
+        for key in sorted(partition_rows or {}, key=int):
+            end = start + partition_rows[key]
+            self.partitions[int(key)] = (start, end)
+            start = end
+
+    def view(self, columns=None, years=None):
+        """DataFrame neuf sur les tableaux partagés.
+
+        Comme read_dataset, `years` choisit les partitions annee_fichier puis
+        filtre exactement sur `annee` : sans copie si les années sont
+        contiguës et qu'aucune ligne n'est écartée par ce filtre.
+        """
+        names = self.columns if columns is None else [c for c in self.columns if c in set(columns)]
+        slices = [(0, self.n_rows)]
+        rows = None
+        if years is not None:
+            slices = []
+            for start, end in sorted(self.partitions[int(y)] for y in years if int(y) in self.partitions):
+                if slices and slices[-1][1] == start:
+                    slices[-1] = (slices[-1][0], end)
+                else:
+                    slices.append((start, end))
+            slices = slices or [(0, 0)]
+            if "annee" in self.arrays:
+                keep = np.isin(self._take("annee", slices), [int(y) for y in years])
+                if not keep.all():
+                    rows = np.flatnonzero(keep)
+
+        data = {}
+        for col in names:
+            values = self._take(col, slices)
+            if rows is not None:
+                values = _read_only(values[rows])
+            if col in self.dtypes:
+                values = pd.Categorical.from_codes(values, dtype=self.dtypes[col], validate=False)
+            data[col] = values
+        return pd.DataFrame(data, columns=names, copy=False)
+
+    def _take(self, col, slices):
+        values = self.arrays[col]
+        if len(slices) == 1:
+            return values[slices[0][0]:slices[0][1]]
+        return _read_only(np.concatenate([values[a:b] for a, b in slices]))
+
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+
+
+def foncieres_dataset(columns=None, shared=None):
+    """Jeu foncieres_all de la version courante du cache, chargé au premier appel.
+
+    En mode mémoire partagée (`shared=True` ou DVF_SHARED_MEMORY=1), les
+    tableaux sont les memmap communs aux workers. Les colonnes facultatives
+    (`dvf_lazy_columns`) sont ajoutées au cache à la première demande. Hors
+    mémoire partagée, seules les colonnes demandées (et celles déjà servies)
+    sont lues ; une nouvelle demande recharge le jeu avec ses colonnes en plus.
+    """
+    if shared is None:
+        shared = shared_memory
+    manifest = ensure_columns(columns)
+    wanted = set(columns if columns is not None else manifest["datasets"]["foncieres_all"]["columns"])
+    key = (manifest["version"], shared)
+
+    dataset = _datasets.get(key)
+    if dataset is not None and wanted <= set(dataset.columns):
+        return dataset
+    with _datasets_lock:
+        dataset = _datasets.get(key)
+        if dataset is not None and wanted <= set(dataset.columns):
+            return dataset
+        if shared:
+            # Une colonne facultative ajoutée depuis change la clé : tableaux rematérialisés
+            manifest = prepare_shared_data()
+            df = data_store.attach_shared(shared_data_key(manifest))
+        else:
+            # Colonnes demandées, celles déjà servies aux autres pages, et `annee` pour les vues par année
+            held = set(dataset.columns) if dataset is not None else set()
+            df = data_store.read_dataset(
+                "foncieres_all", columns=wanted | held | {"annee"}, manifest=manifest
+            )
+        dataset = FoncieresDataset(df, manifest["datasets"]["foncieres_all"]["partition_rows"])
+        del df
+        # Une seule version gardée : les vues déjà distribuées restent valides
+        _datasets.clear()
+        _datasets[key] = dataset
+    return dataset
+
+
+def load_foncieres(columns=None, years=None, shared=None):
+    """Transactions DVF limitées aux colonnes et années demandées.
+
+    Vue en lecture seule sur le jeu partagé par toutes les pages (voir
+    FoncieresDataset) : ajouter une colonne à la vue est possible, modifier
+    les valeurs existantes lève une erreur.
+    """
+    return foncieres_dataset(columns, shared).view(columns, years)
+
+
+def load_dataset(name, columns=None, years=None):
+    """Lit un jeu de données du cache (ex. "pop_dep_all", "dep_annee")."""
+    manifest = ensure_cache()
+    return data_store.read_dataset(name, columns=columns, years=years, manifest=manifest)
+
+
+def load_dep_stats():
+    """Table département × année (médiane, moyenne, effectif, quantiles, population)."""
+    return load_dataset("dep_annee")
+
+
+def load_commune_stats(years=None):
+    """Table commune × année (clé code_insee), limitée aux années demandées."""
+    return load_dataset("commune_annee", years=years)
+
+
+def load_time_cube(niveau="departement", periode="M", years=None):
+    """Cube temporel d'un niveau ("departement" ou "commune").
+
+    `periode` : "M" (mois) ou "T" (trimestre) ; la colonne `date` donne le
+    premier jour de la période, pour tracer directement les séries.
+    """
+    cube = load_dataset(f"cube_{niveau}", years=years)
+    cube = cube[cube["periode"].astype(str) == periode].drop(columns="periode")
+    mois = cube["numero"].astype(int) if periode == "M" else cube["numero"].astype(int) * 3 - 2
+    cube["date"] = pd.to_datetime(pd.DataFrame({"year": cube["annee"].astype(int), "month": mois, "day": 1}))
+    return cube.reset_index(drop=True)
+
+
+def load_cube_sketches(niveau="departement", periode="M", years=None):
+    """Sketches creux des cellules du cube temporel (une ligne par cellule et intervalle).
+
+    Même découpage que load_time_cube ; `sketches.sketch_stats` les fusionne
+    pour tout regroupement de cellules (plusieurs mois, départements...).
+    """
+    cube = load_dataset(f"cube_{niveau}_sketches", years=years)
+    return cube[cube["periode"].astype(str) == periode].drop(columns="periode").reset_index(drop=True)
+
+
+def load_commune_dimension():
+    """Dimension commune : code_insee DVF → code_pop (ligne de population INSEE)."""
+    return load_dataset("communes")
+
+
+def population_keys(code_insee, dimension=None):
+    """Clé de la ligne de population de chaque code_insee DVF (-1 si aucune).
+
+    Recodage par indexation d'un tableau dense : aucune opération sur des chaînes.
+    """
+    dimension = load_commune_dimension() if dimension is None else dimension
+    code_insee = np.asarray(code_insee)
+    size = int(max(dimension["code_insee"].max(), code_insee.max(initial=0))) + 1
+    lookup = np.full(size, -1, dtype=np.int32)
+    lookup[dimension["code_insee"].to_numpy()] = dimension["code_pop"].to_numpy()
+    return np.where(code_insee >= 0, lookup[np.maximum(code_insee, 0)], -1).astype(np.int32)
+
+
+def load_commune_panel(years=None):
+    """Panel commune × année (clé code_pop) avec le nom de chaque commune."""
+    panel = load_dataset("panel_communes", years=years)
+    noms = load_commune_dimension().query("code_pop >= 0").drop_duplicates("code_pop")
+    return panel.merge(noms[["code_pop", "nom_commune"]], on="code_pop", how="left")
+
+
+def load_sketches(columns=None, years=None):
+    """Sketches de quantiles (une ligne par cellule × intervalle de valeur)."""
+    return load_dataset("sketches", columns=columns, years=years)
+
+
+def load_quantile_stats(keys, years=None, exact=None):
+    """Effectif, moyenne et quantiles de la valeur foncière par groupe `keys`.
+
+    `keys` est pris parmi les colonnes de cellule des sketches (département,
+    code_insee, annee, mois). Par défaut les sketches sont fusionnés (erreur
+    relative ≤ 1 %) ; `exact=True` (ou DVF_EXACT_QUANTILES=1) relit les
+    transactions.
+    """
+    keys = list(keys)
+    exact = sketches.exact_quantiles if exact is None else exact
+    if exact:
+        foncieres = load_foncieres(columns=keys + ["Valeur fonciere"], years=years)
+        return aggregations.grouped_stats(foncieres, keys, "Valeur fonciere")
+    return sketches.sketch_stats(load_sketches(columns=keys + ["bucket", "n"], years=years), keys)
+
+
+def load_price_m2_stats(keys, years=None):
+    """Prix au m² par groupe `keys` (voir aggregations.price_per_m2_stats).
+
+    La surface bâtie est une colonne facultative : elle est ajoutée au cache
+    à la première demande.
+    """
+    keys = list(keys)
+    foncieres = load_foncieres(columns=keys + ["Valeur fonciere", "Surface reelle bati"], years=years)
+    return aggregations.price_per_m2_stats(foncieres, keys)
+
+
+def load_all_data(columns=None, years=None, shared=None):
+    """Charge les trois jeux de données depuis le cache Parquet.
+
+    `columns` et `years` ne s'appliquent qu'à `foncieres_all`, renvoyé sous
+    forme de vue en lecture seule (voir load_foncieres).
+    """
+    foncieres_all = load_foncieres(columns=columns, years=years, shared=shared)
+    manifest = data_store.read_manifest()
+    return {
+        "foncieres_all": foncieres_all,
+        "pop_communes": data_store.read_dataset("pop_communes", manifest=manifest),
+        "pop_dep_all": data_store.read_dataset("pop_dep_all", manifest=manifest),
+    }
@@ -0,0 +1,464 @@
+import os
+import json
+import hashlib
+import shutil
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows : pas de verrou inter-processus
+    fcntl = None
+
+# =============================
+# CACHE COLONNAIRE (PARQUET)
+# =============================
+# Un dossier par jeu de données, un fichier Parquet par partition (année),
+# et un manifeste JSON qui décrit le contenu et les fichiers sources utilisés.
+# Une mise à jour ne réécrit que les partitions des années modifiées.
+#
+#   data/cache/
+#     manifest.json
+#     foncieres_all/<génération>/annee_fichier=2020.parquet
+#     foncieres_all/<génération>/annee_fichier=2021.parquet
+#     pop_communes/<génération>/data.parquet
+#     pop_dep_all/<génération>/annee=2020.parquet
+#     dep_annee/<génération>/data.parquet
+#     ...
+#
+# Un fichier écrit n'est jamais modifié : chaque écriture va dans un nouveau
+# dossier de génération, et les partitions inchangées gardent leur chemin.
+# Le manifeste, remplacé en dernier (os.replace), bascule d'un coup vers la
+# nouvelle version ; un processus qui lit encore l'ancien manifeste trouve
+# ses fichiers intacts. Le manifeste remplacé est gardé (manifest.previous.json)
+# et ses fichiers avec lui ; ceux qui ne sont plus référencés par aucun des
+# deux sont supprimés (voir remove_unused_files).
+#
+# Les colonnes DVF facultatives (ex. Type local) sont ajoutées après coup,
+# dans un fichier par colonne et par partition à côté du fichier principal
+# (foncieres_all/<génération>/annee_fichier=2020.Type_local.parquet) : les
+# colonnes déjà présentes ne sont jamais réécrites. Elles sont listées dans
+# `lazy_columns`.
+
+store_dir = os.path.join("data", "cache")
+manifest_file = os.path.join(store_dir, "manifest.json")
+previous_manifest_file = os.path.join(store_dir, "manifest.previous.json")
+shared_dir = os.path.join(store_dir, "shared")
+
+# À incrémenter quand le format des fichiers ou le nettoyage change
+STORE_VERSION = 12
+
+
+# =============================
+# EMPREINTE DES FICHIERS SOURCES
+# =============================
+def file_sha256(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_fingerprint(paths, previous=None):
+    """Taille, mtime et SHA-256 de chaque fichier source existant.
+
+    Le hash d'un fichier n'est recalculé que si sa taille ou son mtime ont
+    changé par rapport à `previous` (empreinte du manifeste précédent).
+    """
+    previous = previous or {}
+    fingerprint = {}
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        stat = os.stat(path)
+        old = previous.get(path)
+        if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+            sha = old["sha256"]
+        else:
+            sha = file_sha256(path)
+        fingerprint[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha}
+    return fingerprint
+
+
+def fingerprint_version(fingerprint):
+    """Identifiant court du jeu de données, dérivé des hash des sources."""
+    h = hashlib.sha256(str(STORE_VERSION).encode())
+    for path in sorted(fingerprint):
+        h.update(path.encode())
+        h.update(fingerprint[path]["sha256"].encode())
+    return h.hexdigest()[:16]
+
+
+# =============================
+# MANIFESTE
+# =============================
+def _read_manifest_file(path=None):
+    """Manifeste sur disque, quel que soit son format (None s'il est absent ou illisible)."""
+    try:
+        with open(path or manifest_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, payload):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def read_manifest():
+    manifest = _read_manifest_file()
+    if manifest is None or manifest.get("store_version") != STORE_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(manifest):
+    """Publie `manifest` (remplacement atomique), puis supprime les fichiers périmés.
+
+    Quand la version change, le manifeste remplacé est gardé dans
+    `previous_manifest_file` avec ses fichiers : un lecteur qui l'a lu juste
+    avant peut finir sa lecture. Seuls les fichiers de la version d'avant
+    sont supprimés. Appelé sous le verrou "build".
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    previous = _read_manifest_file()
+    if previous is not None and previous.get("version") != manifest["version"]:
+        _write_json(previous_manifest_file, previous)
+    _write_json(manifest_file, manifest)
+    remove_unused_files([manifest, _read_manifest_file(previous_manifest_file)])
+
+
+def referenced_files(manifest):
+    """Chemins relatifs de tous les fichiers utilisés par un manifeste."""
+    paths = set()
+    for entry in (manifest or {}).get("datasets", {}).values():
+        for rel_path in entry["partitions"].values():
+            paths.add(os.path.normpath(rel_path))
+            paths.update(os.path.normpath(column_path(rel_path, c)) for c in entry.get("lazy_columns", []))
+    return paths
+
+
+def remove_unused_files(manifests):
+    """Supprime les fichiers des jeux de données qui ne sont référencés par aucun de `manifests`.
+
+    Seuls les dossiers des jeux de données sont parcourus (pas figures/,
+    shared/, index/...) ; les dossiers de génération vidés sont retirés.
+    """
+    keep = set()
+    names = set()
+    for manifest in manifests:
+        keep |= referenced_files(manifest)
+        names |= set((manifest or {}).get("datasets", {}))
+    for name in names:
+        dataset_dir = os.path.join(store_dir, name)
+        for root, dirs, files in os.walk(dataset_dir, topdown=False):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                if os.path.normpath(os.path.relpath(path, store_dir)) not in keep:
+                    os.remove(path)
+            if root != dataset_dir and not os.listdir(root):
+                os.rmdir(root)
+
+
+def dataset_version():
+    """Version du cache courant (None si aucun cache valide)."""
+    manifest = read_manifest()
+    return manifest["version"] if manifest else None
+
+
+# =============================
+# ÉCRITURE / LECTURE
+# =============================
+def _to_arrow_friendly(df):
+    """Convertit en str les colonnes objet de types mélangés (ex. codes 2A/2B et entiers)."""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) != "string":
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def _write_parquet(df, path):
+    tmp = path + ".tmp"
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def write_frame(df, path):
+    """Écrit un DataFrame isolé en Parquet (écriture atomique)."""
+    _write_parquet(_to_arrow_friendly(df).reset_index(drop=True), path)
+
+
+def column_path(rel_path, col):
+    """Chemin relatif du fichier d'une colonne facultative pour une partition."""
+    return f"{rel_path[:-len('.parquet')]}.{col.replace(' ', '_')}.parquet"
+
+
+def _write_column(rel_path, df, col):
+    _write_parquet(
+        _to_arrow_friendly(df[[col]]).reset_index(drop=True),
+        os.path.join(store_dir, column_path(rel_path, col)),
+    )
+
+
+def new_generation(name):
+    """Nouveau dossier (relatif) pour les fichiers d'une écriture du jeu `name`."""
+    rel_dir = os.path.join(name, uuid.uuid4().hex[:12])
+    os.makedirs(os.path.join(store_dir, rel_dir))
+    return rel_dir
+
+
+def write_partition(rel_dir, df, partition_col, key, lazy_columns=()):
+    """Écrit une partition dans le dossier de génération `rel_dir` et renvoie son chemin relatif.
+
+    Les colonnes de `lazy_columns` vont chacune dans leur propre fichier.
+    """
+    rel_path = os.path.join(rel_dir, f"{partition_col}={key}.parquet")
+    main = df.drop(columns=[c for c in lazy_columns if c in df.columns])
+    _write_parquet(_to_arrow_friendly(main).reset_index(drop=True), os.path.join(store_dir, rel_path))
+    for col in lazy_columns:
+        _write_column(rel_path, df, col)
+    return rel_path
+
+
+def write_dataset(name, df, partition_col=None, lazy_columns=()):
+    """Écrit un jeu de données dans le cache et renvoie sa description pour le manifeste.
+
+    Les fichiers de la version précédente restent en place jusqu'au
+    nettoyage qui suit l'écriture du manifeste.
+    """
+    rel_dir = new_generation(name)
+    entry = {
+        "columns": list(df.columns),
+        "n_rows": int(len(df)),
+        "partition_col": partition_col,
+        "partitions": {},
+        "partition_rows": {},
+        "lazy_columns": [c for c in lazy_columns if c in df.columns],
+    }
+
+    if partition_col is None:
+        rel_path = os.path.join(rel_dir, "data.parquet")
+        _write_parquet(_to_arrow_friendly(df), os.path.join(store_dir, rel_path))
+        entry["partitions"]["all"] = rel_path
+        entry["partition_rows"]["all"] = int(len(df))
+        return entry
+
+    keys = df[partition_col].astype(int)
+    for key, part in df.groupby(keys, sort=True):
+        entry["partitions"][str(key)] = write_partition(rel_dir, part, partition_col, key, entry["lazy_columns"])
+        entry["partition_rows"][str(key)] = int(len(part))
+    return entry
+
+
+def replace_partitions(entry, name, df, keys):
+    """Réécrit uniquement les partitions `keys` d'un jeu partitionné.
+
+    Les nouvelles partitions vont dans un nouveau dossier de génération ; les
+    autres gardent leurs fichiers. Une clé absente de `df` est retirée de
+    l'entrée (ses fichiers sont supprimés au nettoyage). Renvoie l'entrée de
+    manifeste mise à jour.
+    """
+    entry = dict(entry, partitions=dict(entry["partitions"]), partition_rows=dict(entry["partition_rows"]))
+    partition_col = entry["partition_col"]
+    lazy_columns = entry.get("lazy_columns", [])
+    values = df[partition_col].astype(int)
+    rel_dir = None
+    for key in keys:
+        key = int(key)
+        part = df[values == key]
+        if len(part) == 0:
+            entry["partitions"].pop(str(key), None)
+            entry["partition_rows"].pop(str(key), None)
+            continue
+        rel_dir = rel_dir or new_generation(name)
+        entry["partitions"][str(key)] = write_partition(rel_dir, part, partition_col, key, lazy_columns)
+        entry["partition_rows"][str(key)] = int(len(part))
+    entry["n_rows"] = int(sum(entry["partition_rows"].values()))
+    return entry
+
+
+def add_columns(entry, name, df, columns, check_cols=()):
+    """Ajoute les colonnes `columns` de `df` à un jeu partitionné déjà écrit.
+
+    `df` doit contenir, partition par partition, exactement les mêmes lignes
+    dans le même ordre que le cache ; `check_cols` sont comparées aux colonnes
+    stockées pour le vérifier. Seuls les fichiers des nouvelles colonnes sont
+    écrits. Renvoie l'entrée de manifeste mise à jour.
+    """
+    partition_col = entry["partition_col"]
+    values = df[partition_col].astype(int).to_numpy()
+    for key, rel_path in entry["partitions"].items():
+        part = df[values == int(key)]
+        stored = pd.read_parquet(os.path.join(store_dir, rel_path), columns=list(check_cols))
+        if len(part) != entry["partition_rows"][key] or any(
+            not np.array_equal(stored[c].to_numpy(), part[c].to_numpy()) for c in check_cols
+        ):
+            raise ValueError(
+                f"{name} {partition_col}={key} : les lignes relues ne correspondent pas au cache"
+            )
+        for col in columns:
+            _write_column(rel_path, part, col)
+
+    new_columns = [c for c in columns if c not in entry["columns"]]
+    return dict(
+        entry,
+        columns=entry["columns"] + new_columns,
+        lazy_columns=entry.get("lazy_columns", []) + new_columns,
+    )
+
+
+def read_dataset(name, columns=None, years=None, manifest=None):
+    """Lit un jeu de données du cache.
+
+    `columns` limite les colonnes lues (projection) et `years` les partitions
+    lues ; seuls les fichiers et colonnes demandés sont chargés.
+    """
+    manifest = manifest or read_manifest()
+    if manifest is None or name not in manifest["datasets"]:
+        raise FileNotFoundError(f"Jeu de données '{name}' absent du cache {store_dir}")
+
+    entry = manifest["datasets"][name]
+    partitions = entry["partitions"]
+    if years is not None and entry["partition_col"] is not None:
+        wanted = {str(int(a)) for a in years}
+        partitions = {k: v for k, v in partitions.items() if k in wanted}
+
+    if columns is not None:
+        columns = [c for c in entry["columns"] if c in set(columns)]
+    wanted = columns if columns is not None else entry["columns"]
+    lazy = [c for c in wanted if c in entry.get("lazy_columns", [])]
+    main = [c for c in wanted if c not in lazy]
+
+    def read_partition(rel_path):
+        df = pd.read_parquet(os.path.join(store_dir, rel_path), columns=main)
+        if not lazy:
+            return df
+        data = {c: df[c] for c in main}
+        for col in lazy:
+            data[col] = pd.read_parquet(os.path.join(store_dir, column_path(rel_path, col)))[col]
+        return pd.DataFrame(data)[wanted]
+
+    frames = [read_partition(rel_path) for _, rel_path in sorted(partitions.items())]
+    if not frames:
+        if entry["partitions"]:
+            # Aucune partition retenue : frame vide, mais avec les types stockés
+            return read_partition(next(iter(entry["partitions"].values()))).iloc[:0].reset_index(drop=True)
+        return pd.DataFrame(columns=columns if columns is not None else entry["columns"])
+    df = pd.concat(frames, ignore_index=True)
+
+    # Les partitions sont choisies sur leur clé ; le filtre exact porte sur `annee`
+    if years is not None and "annee" in df.columns and entry["partition_col"] != "annee":
+        df = df[df["annee"].isin(list(years))].reset_index(drop=True)
+    return df
+
+
+# =============================
+# VERROU INTER-PROCESSUS
+# =============================
+@contextmanager
+def store_lock(name):
+    """Verrou exclusif sur un fichier, partagé entre les workers gunicorn."""
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, f".{name}.lock"), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# =============================
+# MÉMOIRE PARTAGÉE (MEMMAP)
+# =============================
+# Les colonnes de foncieres_all sont écrites une fois en tableaux .npy
+# (les colonnes texte sous forme de codes entiers + catégories). Chaque worker
+# les ouvre ensuite en lecture seule avec np.load(mmap_mode="r") : les pages
+# du fichier sont partagées par le cache du noyau au lieu d'être copiées.
+
+def shared_key(version, columns):
+    """Nom du dossier memmap : version du cache + jeu de colonnes matérialisé.
+
+    Une colonne facultative ajoutée au cache (même version) change la clé :
+    les tableaux sont alors réécrits avec elle.
+    """
+    digest = hashlib.sha256(json.dumps(sorted(columns)).encode()).hexdigest()[:8]
+    return f"{version}-{digest}"
+
+
+def shared_path(key):
+    return os.path.join(shared_dir, key)
+
+
+def has_shared(key):
+    return os.path.exists(os.path.join(shared_path(key), "meta.json"))
+
+
+def materialize_shared(df, key):
+    """Écrit `df` en tableaux memmap sous la clé `key` (voir shared_key)."""
+    target = shared_path(key)
+    if has_shared(key):
+        return target
+
+    tmp = f"{target}.tmp{os.getpid()}"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    meta = {"n_rows": int(len(df)), "columns": {}}
+    for i, col in enumerate(df.columns):
+        s = df[col]
+        file_name = f"col{i}.npy"
+        if isinstance(s.dtype, pd.CategoricalDtype) or s.dtype == object:
+            cat = s.cat if isinstance(s.dtype, pd.CategoricalDtype) else pd.Categorical(s.astype(str))
+            # Codes dans le type entier choisi par pandas pour éviter une copie à l'attache
+            np.save(os.path.join(tmp, file_name), np.asarray(cat.codes))
+            meta["columns"][col] = {
+                "kind": "category",
+                "file": file_name,
+                "categories": [str(c) for c in cat.categories],
+            }
+        else:
+            np.save(os.path.join(tmp, file_name), s.to_numpy())
+            meta["columns"][col] = {"kind": "array", "file": file_name}
+
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(tmp, target)
+
+    # Supprimer les anciennes versions (ou anciens jeux de colonnes)
+    for old in os.listdir(shared_dir):
+        if old != key and not old.startswith(f"{key}.tmp"):
+            shutil.rmtree(os.path.join(shared_dir, old), ignore_errors=True)
+    return target
+
+
+def attach_shared(key):
+    """DataFrame en lecture seule adossé aux tableaux memmap (sans copie).
+
+    Les colonnes et années sont choisies ensuite par des vues (FoncieresDataset).
+    """
+    target = shared_path(key)
+    with open(os.path.join(target, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+
+    data = {}
+    for col, info in meta["columns"].items():
+        values = np.load(os.path.join(target, info["file"]), mmap_mode="r")
+        if info["kind"] == "category":
+            dtype = pd.CategoricalDtype(info["categories"])
+            values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+        data[col] = values
+    return pd.DataFrame(data, columns=list(meta["columns"]), copy=False)
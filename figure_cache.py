@@ -0,0 +1,119 @@
+import os
+import gzip
+import json
+import hashlib
+import inspect
+import shutil
+
+import plotly.io as pio
+
+import data_store
+
+# =============================
+# CACHE DES FIGURES
+# =============================
+# Les figures de chaque page sont sérialisées en JSON Plotly (compressé en
+# gzip) dans data/cache/figures/<version des données>/. Le premier worker qui
+# construit une page écrit le fichier ; les autres le relisent directement,
+# sans recalculer les agrégations ni reconstruire les objets Plotly.
+
+figures_dir = os.path.join(data_store.store_dir, "figures")
+compress = os.environ.get("FIGURE_CACHE_COMPRESS", "1") == "1"
+
+# Le code du module de chaque page entre dans la clé (voir code_version) ;
+# à incrémenter quand un code partagé qui change les figures est modifié
+# (ex. aggregations.fill_population)
+FIGURES_VERSION = 1
+
+_memory = {}
+_code_versions = {}
+
+
+def code_version(build):
+    """Empreinte du fichier source qui définit `build` (mise en page, couleurs...)."""
+    path = inspect.getsourcefile(build)
+    if path not in _code_versions:
+        with open(path, "rb") as f:
+            _code_versions[path] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return _code_versions[path]
+
+
+def figure_key(name, params=None, code=None):
+    """Nom de fichier d'un jeu de figures : page + empreinte des paramètres et du code."""
+    raw = json.dumps([params or {}, code, FIGURES_VERSION], sort_keys=True, default=str)
+    return f"{name}-{hashlib.sha256(raw.encode()).hexdigest()[:12]}"
+
+
+def _figure_path(version, key):
+    return os.path.join(figures_dir, version, key + (".json.gz" if compress else ".json"))
+
+
+def _read(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write(path, payload):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(tmp, "wt", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp, path)
+
+
+def _remove_old_versions(version):
+    if not os.path.isdir(figures_dir):
+        return
+    for old in os.listdir(figures_dir):
+        if old != version:
+            # D'autres workers peuvent nettoyer (ou écrire) en même temps : erreurs ignorées
+            shutil.rmtree(os.path.join(figures_dir, old), ignore_errors=True)
+
+
+def serialize_figures(figures):
+    """{nom: figure Plotly} → JSON (les tableaux numpy sont convertis par Plotly)."""
+    return "{" + ",".join(
+        f"{json.dumps(name)}:{pio.to_json(fig, validate=False)}" for name, fig in figures.items()
+    ) + "}"
+
+
+def cached_figures(name, build, params=None, version=None):
+    """Figures d'une page sous forme de dictionnaires JSON prêts à envoyer.
+
+    `build(**params)` renvoie {nom: figure Plotly} ; il n'est appelé que si
+    aucune version sérialisée n'existe pour la version courante des données,
+    ces paramètres et ce code de page.
+    """
+    version = version or data_store.dataset_version()
+    key = figure_key(name, params, code_version(build))
+    if version is None:
+        # Premier démarrage : le cache des données est construit par `build`
+        payload = serialize_figures(build(**(params or {})))
+        figures = json.loads(payload)
+        version = data_store.dataset_version()
+        if version is not None:
+            _write(_figure_path(version, key), payload)
+            _memory[(version, key)] = figures
+        return figures
+
+    memo_key = (version, key)
+    if memo_key in _memory:
+        return _memory[memo_key]
+
+    path = _figure_path(version, key)
+    with data_store.store_lock(f"figure-{key}"):
+        if os.path.exists(path):
+            figures = _read(path)
+        else:
+            payload = serialize_figures(build(**(params or {})))
+            _write(path, payload)
+            _remove_old_versions(version)
+            figures = json.loads(payload)
+
+    # Après un rafraîchissement des données, les figures des anciennes versions sont oubliées
+    for old_key in [k for k in _memory if k[0] != version]:
+        _memory.pop(old_key, None)
+    _memory[memo_key] = figures
+    return figures
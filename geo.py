@@ -0,0 +1,222 @@
+import os
+import gzip
+import json
+import urllib.request
+
+import numpy as np
+
+import data_store
+
+# =============================
+# CONTOURS GÉOGRAPHIQUES
+# =============================
+# Les variantes simplifiées (Douglas-Peucker) du GeoJSON des départements
+# sont écrites dans data/geo : JSON compact (coordonnées arrondies, propriétés
+# inutiles retirées) compressé en gzip, servi par le serveur Flask de l'appli.
+# Elles sont construites au déploiement, avant les requêtes : par le master
+# gunicorn (on_starting) ou au lancement de `python app.py`. La source n'est
+# téléchargée qu'une fois (gardée dans data/geo) ; l'import de l'appli ne
+# télécharge rien. `python geo.py` force le retéléchargement et la
+# régénération.
+
+DEPARTEMENTS_URL = "https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements.geojson"
+
+geo_dir = os.path.join("data", "geo")
+source_file = os.path.join(geo_dir, "departements.geojson")
+route_prefix = "/geo/"
+
+# Tolérances en degrés (0.01° ≈ 1 km), de la plus fine à la plus grossière
+TOLERANCES = (0.001, 0.005, 0.02)
+# Échelle de zoom (geo.projection.scale) au-delà de laquelle chaque variante devient nécessaire
+ZOOM_SCALES = {0.02: 0.0, 0.005: 2.5, 0.001: 8.0}
+DEFAULT_TOLERANCE = 0.02
+PRECISION = 4  # décimales conservées (≈ 10 m)
+
+
+def download_departements(force=False):
+    """Télécharge le GeoJSON source s'il est absent ; renvoie son chemin ou None."""
+    if os.path.exists(source_file) and not force:
+        return source_file
+    os.makedirs(geo_dir, exist_ok=True)
+    try:
+        with urllib.request.urlopen(DEPARTEMENTS_URL, timeout=30) as response:
+            raw = response.read()
+    except OSError as e:
+        print(f"⚠ Téléchargement du GeoJSON impossible : {e}")
+        return None
+    tmp = f"{source_file}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, source_file)
+    print(f"✓ GeoJSON des départements téléchargé → {source_file}")
+    return source_file
+
+
+# =============================
+# SIMPLIFICATION
+# =============================
+def simplify_line(coords, tolerance):
+    """Douglas-Peucker sur une suite de points (tableau n × 2)."""
+    n = len(coords)
+    if n < 3:
+        return coords
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        a, b = coords[start], coords[end]
+        segment = coords[start + 1:end]
+        ab = b - a
+        norm = np.hypot(ab[0], ab[1])
+        if norm == 0:
+            dist = np.hypot(segment[:, 0] - a[0], segment[:, 1] - a[1])
+        else:
+            dist = np.abs(ab[0] * (segment[:, 1] - a[1]) - ab[1] * (segment[:, 0] - a[0])) / norm
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            mid = start + 1 + i
+            keep[mid] = True
+            stack.append((start, mid))
+            stack.append((mid, end))
+    return coords[keep]
+
+
+def simplify_ring(ring, tolerance):
+    """Anneau simplifié ; None s'il devient trop petit pour rester un polygone."""
+    coords = np.asarray(ring, dtype=np.float64)
+    simplified = simplify_line(coords, tolerance)
+    if len(simplified) < 4:
+        return None
+    return np.round(simplified, PRECISION).tolist()
+
+
+def simplify_polygon(polygon, tolerance):
+    exterior = simplify_ring(polygon[0], tolerance)
+    if exterior is None:
+        # Petites îles : contour d'origine conservé plutôt que supprimé
+        exterior = np.round(np.asarray(polygon[0]), PRECISION).tolist()
+    holes = [r for r in (simplify_ring(h, tolerance) for h in polygon[1:]) if r is not None]
+    return [exterior] + holes
+
+
+def simplify_geojson(geojson, tolerance, properties=("code", "nom")):
+    """Copie allégée d'une FeatureCollection de polygones."""
+    features = []
+    for feature in geojson["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            coords = simplify_polygon(geometry["coordinates"], tolerance)
+        else:
+            coords = [simplify_polygon(p, tolerance) for p in geometry["coordinates"]]
+        features.append({
+            "type": "Feature",
+            "properties": {k: feature["properties"].get(k) for k in properties},
+            "geometry": {"type": geometry["type"], "coordinates": coords},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def variant_name(tolerance):
+    return f"departements-{tolerance:g}.geojson"
+
+
+def variant_path(tolerance):
+    return os.path.join(geo_dir, variant_name(tolerance))
+
+
+def build_variants(force=False):
+    """Écrit les variantes simplifiées (JSON compact gzip) si elles sont périmées."""
+    with data_store.store_lock("geo"):
+        if download_departements() is None:
+            return False
+        source_mtime = os.path.getmtime(source_file)
+        todo = [
+            t for t in TOLERANCES
+            if force or not os.path.exists(variant_path(t) + ".gz")
+            or os.path.getmtime(variant_path(t) + ".gz") < source_mtime
+        ]
+        if not todo:
+            return True
+        with open(source_file, encoding="utf-8") as f:
+            geojson = json.load(f)
+        for tolerance in todo:
+            payload = json.dumps(simplify_geojson(geojson, tolerance), separators=(",", ":"))
+            target = variant_path(tolerance) + ".gz"
+            tmp = f"{target}.tmp{os.getpid()}"
+            # mtime=0 : fichier identique d'une génération à l'autre (diff git propre)
+            with gzip.GzipFile(tmp, "wb", mtime=0) as f:
+                f.write(payload.encode("utf-8"))
+            os.replace(tmp, target)
+            size = os.path.getsize(target) / 1e3
+            print(f"✓ {variant_name(tolerance)} : {size:,.0f} ko (gzip)")
+        return True
+
+
+# =============================
+# CHOIX DE LA VARIANTE
+# =============================
+def tolerance_for_scale(scale=None):
+    """Variante la plus grossière encore lisible à l'échelle de zoom donnée."""
+    if scale is None:
+        return DEFAULT_TOLERANCE
+    acceptable = [t for t, minimum in ZOOM_SCALES.items() if scale >= minimum]
+    return min(acceptable) if acceptable else DEFAULT_TOLERANCE
+
+
+def departements_geojson(scale=None):
+    """URL du GeoJSON à passer à Plotly : variante locale, sinon source distante.
+
+    La source distante ne sert que si la construction des variantes a échoué
+    (pas de réseau au premier déploiement, par exemple).
+    """
+    tolerance = tolerance_for_scale(scale)
+    if os.path.exists(variant_path(tolerance) + ".gz"):
+        return route_prefix + variant_name(tolerance)
+    return DEPARTEMENTS_URL
+
+
+# =============================
+# ROUTE FLASK
+# =============================
+def register_routes(server, max_age=30 * 24 * 3600):
+    """Sert data/geo avec cache navigateur (ETag + max-age) et gzip précompressé.
+
+    Les variantes n'existent qu'en .gz : un client qui n'accepte pas gzip
+    reçoit le JSON décompressé avant la construction de la réponse, si bien
+    qu'une requête Range ou conditionnelle porte sur le JSON et non sur les
+    octets compressés.
+    """
+    from flask import abort, request, send_from_directory
+
+    @server.route(route_prefix + "<path:filename>")
+    def serve_geojson(filename):
+        directory = os.path.abspath(geo_dir)
+        gzipped = os.path.join(directory, filename + ".gz")
+        if not os.path.exists(gzipped) or os.path.dirname(os.path.normpath(filename)):
+            abort(404)
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response = send_from_directory(
+                directory, filename + ".gz", max_age=max_age,
+                mimetype="application/geo+json", conditional=True,
+            )
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            with gzip.open(gzipped, "rb") as f:
+                payload = f.read()
+            response = server.response_class(payload, mimetype="application/geo+json")
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            response.add_etag()
+            response = response.make_conditional(request, accept_ranges=True, complete_length=len(payload))
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    return serve_geojson
+
+
+if __name__ == "__main__":
+    download_departements(force=True)
+    build_variants(force=True)
@@ -0,0 +1,20 @@
+# Configuration gunicorn :
+#   gunicorn -c gunicorn.conf.py app:server
+import os
+
+# Les workers s'attachent en lecture seule aux tableaux memmap de foncieres_all
+os.environ.setdefault("DVF_SHARED_MEMORY", "1")
+
+bind = os.environ.get("BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("WEB_CONCURRENCY", "4"))
+timeout = 300
+
+
+def on_starting(server):
+    # Le master prépare le cache, les tableaux partagés et les contours
+    # simplifiés de la carte avant de lancer les workers
+    import geo
+    from data_loader import extract_all_zips, prepare_shared_data
+    extract_all_zips()
+    prepare_shared_data()
+    geo.build_variants()
@@ -1,55 +1,40 @@
-import dash
 from dash import dcc, html
 import plotly.express as px
-from data_loader import load_all_data
+from data_loader import load_dep_stats
 import pandas as pd
 import numpy as np
+from figure_cache import cached_figures
+from geo import departements_geojson
 
-dash.register_page(__name__, path='/')
 
-data = load_all_data()
-foncieres_all = data["foncieres_all"]
+def build_figures(geojson):
+    """Calcule les données de la page et construit ses figures Plotly."""
+    # =============================
+    # CARTE 1 — DEPARTEMENTS
+    # =============================
+    valeur_dep = (
+        load_dep_stats()[["Code departement", "annee", "Valeur_mediane"]]
+        .sort_values(["annee", "Code departement"])
+    )
+    valeur_dep["annee"] = valeur_dep["annee"].astype(str)
 
-# =============================
-# NETTOYAGE GLOBAL
-# =============================
-foncieres_all.columns = foncieres_all.columns.str.strip()
-
-foncieres_all["Valeur fonciere"] = (
-    foncieres_all["Valeur fonciere"]
-    .astype(str)
-    .str.replace(",", ".")
-    .astype(float)
-)
-
-foncieres_all["Code commune"] = foncieres_all["Code commune"].astype(str).str.zfill(5)
-foncieres_all["Code departement"] = foncieres_all["Code departement"].astype(str)
-foncieres_all["annee"] = foncieres_all["annee"].astype(str)
-
-# =============================
-# CARTE 1 — DEPARTEMENTS
-# =============================
-valeur_dep = (
-    foncieres_all
-    .groupby(["Code departement", "annee"])["Valeur fonciere"]
-    .median()
-    .reset_index(name="Valeur_mediane")
-)
+    fig = px.choropleth(
+        valeur_dep,
+        geojson=geojson,  # variante simplifiée servie par l'appli (voir geo.py)
+        locations="Code departement",
+        featureidkey="properties.code",
+        color="Valeur_mediane",
+        animation_frame="annee",
+        color_continuous_scale="YlOrRd"
+    )
 
-fig = px.choropleth(
-    valeur_dep,
-    geojson="https://raw.githubusercontent.com/gregoiredavid/france-geojson/master/departements.geojson",
-    locations="Code departement",
-    featureidkey="properties.code",
-    color="Valeur_mediane",
-    animation_frame="annee",
-    color_continuous_scale="YlOrRd"
-)
+    fig.update_geos(fitbounds="locations", visible=False)
+    fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0}, uirevision="carte")
 
-fig.update_geos(fitbounds="locations", visible=False)
-fig.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
+    return {"fig": fig}
 
 
+figures = cached_figures("home", build_figures, {"geojson": departements_geojson()})
 
 # =============================
 # LAYOUT
@@ -59,7 +44,8 @@ layout = html.Div([
     
     html.Div([
         dcc.Graph(
-            figure=fig,
+            id="carte-departements",
+            figure=figures["fig"],
             style={
                 "width": "100%",
                 "height": "80vh",  # 90% de la hauteur de la fenêtre
@@ -8,6 +8,8 @@ def create_nav_bar():
         {'label': 'Commune', 'href': '/page2'},
         {'label': 'Age', 'href': '/page3'},
         {'label': 'Prédiction', 'href': '/page4'},
+        {'label': 'Carte communes', 'href': '/page5'},
+        {'label': 'Explorer', 'href': '/page6'},
     ]
 
     nav_bar = html.Div(
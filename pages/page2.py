@@ -1,108 +1,205 @@
-import dash
-from dash import dcc, html
-import plotly.express as px
-from data_loader import load_all_data
-import pandas as pd
+import threading
 
-dash.register_page(__name__, path="/page2")
+from dash import dcc, html, dash_table, callback, Input, Output
+import plotly.io as pio
+import numpy as np
+import data_store
+from data_loader import ensure_cache, load_commune_panel
 
 # =============================
-# CHARGEMENT DES DONNÉES
+# VALEURS FONCIÈRES ET POPULATION COMMUNALE
 # =============================
-data = load_all_data()
-foncieres_all = data["foncieres_all"]
-pop_communes = data["pop_communes"]
+# Toutes les communes, pas seulement les 100 plus peuplées : la page lit le
+# panel commune × année précalculé dans le cache (médiane, effectif et
+# population de l'année). Rien n'est chargé à l'import ; les callbacks
+# filtrent le panel en mémoire et ne renvoient au navigateur que les points
+# affichés et la page courante du tableau.
 
-# =============================
-# PRÉPARATION DES CODES INSEE
-# =============================
-foncieres_all["Code departement"] = (
-    foncieres_all["Code departement"].astype(str).str.zfill(2)
-)
-foncieres_all["Code commune"] = (
-    foncieres_all["Code commune"].astype(str).str.zfill(3)
-)
+# Les figures sont renvoyées en dictionnaires (pas de validation Plotly)
+TEMPLATE = pio.templates["plotly_white"].to_plotly_json()
 
-foncieres_all["code_insee"] = (
-    foncieres_all["Code departement"] +
-    foncieres_all["Code commune"]
-)
+# Au-delà de WEBGL_THRESHOLD points, rendu WebGL (scattergl) ; au-delà de
+# MAX_POINTS, un échantillon fixe de communes est affiché
+WEBGL_THRESHOLD = 1000
+MAX_POINTS = 15000
+PAGE_SIZE = 20
 
-# Fusion des arrondissements de Paris
-foncieres_all.loc[
-    foncieres_all["code_insee"].str.startswith("751"),
-    "code_insee"
-] = "75056"
+COLONNES = {
+    "nom_commune": "Commune",
+    "population": "Population",
+    "Valeur_mediane": "Valeur médiane (€)",
+    "Nb_transactions": "Transactions",
+}
 
-# =============================
-# TOP 100 COMMUNES (POP 2023)
-# =============================
-top_100_communes = (
-    pop_communes
-    .nlargest(100, "pop_2023")
-    .copy()
-)
+_panels = {}
+_lock = threading.Lock()
+
+
+def get_panel():
+    """Panel de la version courante du cache, chargé une fois par processus."""
+    version = data_store.dataset_version() or ensure_cache()["version"]
+    panel = _panels.get(version)
+    if panel is not None:
+        return panel
+
+    with _lock:
+        panel = _panels.get(version)
+        if panel is None:
+            panel = load_commune_panel()
+            panel["nom_commune"] = panel["nom_commune"].fillna("").astype(str)
+            # Rang de tirage fixe par commune : l'échantillon ne change pas
+            # d'une année ou d'un filtre à l'autre
+            codes = panel["code_pop"].to_numpy()
+            uniques, inverse = np.unique(codes, return_inverse=True)
+            panel["tirage"] = np.random.default_rng(0).permutation(len(uniques))[inverse]
+            _panels.clear()
+            _panels[version] = panel
+    return panel
+
+
+def warm_up():
+    """Charge le panel avant la première visite."""
+    get_panel()
+
+
+def select(annee, min_transactions):
+    panel = get_panel()
+    mask = panel["annee"].to_numpy() == (annee if annee is not None else panel["annee"].max())
+    if min_transactions:
+        mask &= panel["Nb_transactions"].to_numpy() >= min_transactions
+    return panel[mask]
+
+
+def empty_figure(message):
+    return {
+        "data": [],
+        "layout": {
+            "annotations": [{
+                "text": message, "xref": "paper", "yref": "paper",
+                "x": 0.5, "y": 0.5, "showarrow": False, "font": {"size": 16}
+            }],
+            "template": TEMPLATE,
+            "height": 600
+        }
+    }
 
-# =============================
-# AGRÉGATION DVF PAR COMMUNE
-# =============================
-valeur_communes = (
-    foncieres_all[
-        foncieres_all["code_insee"].isin(top_100_communes["code_commune"])
-    ]
-    .groupby(["code_insee", "annee"])
-    .agg(
-        Valeur_mediane=("Valeur fonciere", "median"),
-        Nb_transactions=("Valeur fonciere", "count")
-    )
-    .reset_index()
-)
 
 # =============================
-# FUSION AVEC POPULATION
+# LAYOUT
 # =============================
-df_communes = valeur_communes.merge(
-    top_100_communes[
-        ["code_commune", "nom_commune", "pop_2023"]
-    ],
-    left_on="code_insee",
-    right_on="code_commune",
-    how="inner"
-)
+def layout():
+    """Layout recalculé à chaque visite : les années suivent les données rafraîchies."""
+    annees = sorted(int(a) for a in get_panel()["annee"].unique())
+    return html.Div([
+        html.H1("Valeurs foncières et population communale."),
+
+        html.Div([
+            html.Label("Année"),
+            dcc.Slider(
+                id="panel-annee",
+                min=annees[0], max=annees[-1], step=1,
+                value=annees[-1],
+                marks={a: str(a) for a in annees}
+            ),
+
+            html.Label("Nombre minimal de transactions"),
+            dcc.Input(id="panel-min-transactions", type="number", min=1, value=5, debounce=True),
+        ], style={"maxWidth": "900px", "margin": "20px 0"}),
+
+        html.Div(id="panel-resume", style={"fontSize": "18px", "margin": "10px 0"}),
+
+        dcc.Graph(id="panel-scatter"),
+
+        html.Hr(),
+
+        # Pagination et tri côté serveur : seule la page affichée est envoyée
+        dash_table.DataTable(
+            id="panel-table",
+            columns=[{"name": nom, "id": col} for col, nom in COLONNES.items()],
+            page_current=0,
+            page_size=PAGE_SIZE,
+            page_action="custom",
+            sort_action="custom",
+            sort_mode="single",
+            sort_by=[{"column_id": "Nb_transactions", "direction": "desc"}],
+        )
+    ])
+
 
 # =============================
-# FIGURE — SCATTER ANIMÉ
+# CALLBACKS
 # =============================
-fig_scatter = px.scatter(
-    df_communes,
-    x="pop_2023",
-    y="Valeur_mediane",
-    size="Nb_transactions",
-    animation_frame="annee",
-    hover_name="nom_commune",
-    title="Valeurs foncières vs Population — Top 100 communes",
-    labels={
-        "pop_2023": "Population (2023)",
-        "Valeur_mediane": "Valeur foncière médiane (€)",
-        "annee": "Année",
-        "Nb_transactions": "Nombre de transactions"
-    },
-    template="plotly_white",
-    height=600,
-    log_x=True,
-    size_max=45
+@callback(
+    Output("panel-resume", "children"),
+    Output("panel-scatter", "figure"),
+    Input("panel-annee", "value"),
+    Input("panel-min-transactions", "value"),
 )
+def update_scatter(annee, min_transactions):
+    communes = select(annee, min_transactions)
+    # Échelle logarithmique : communes sans population connue écartées
+    communes = communes[communes["population"].to_numpy() > 0]
+    if len(communes) == 0:
+        message = "Aucune commune ne correspond à ces filtres"
+        return message, empty_figure(message)
 
-fig_scatter.update_layout(
-    xaxis_title="Population (échelle logarithmique)",
-    yaxis_title="Valeur foncière médiane (€)"
-)
+    resume = f"{len(communes):,} communes"
+    if len(communes) > MAX_POINTS:
+        communes = communes.nsmallest(MAX_POINTS, "tirage")
+        resume += f" — échantillon de {MAX_POINTS:,} communes affiché"
 
-# =============================
-# LAYOUT
-# =============================
-layout = html.Div([
-    html.H1("Valeurs foncières et population communale."),
+    annee_pop = int(communes["annee_pop"].iloc[0])
+    taille = communes["Nb_transactions"].to_numpy()
+    fig = {
+        "data": [{
+            "type": "scattergl" if len(communes) > WEBGL_THRESHOLD else "scatter",
+            "mode": "markers",
+            "x": communes["population"].tolist(),
+            "y": communes["Valeur_mediane"].round(0).tolist(),
+            "text": communes["nom_commune"].tolist(),
+            "customdata": taille.tolist(),
+            "hovertemplate": "%{text}<br>Population : %{x:,}<br>Médiane : %{y:,.0f} €"
+                             "<br>Transactions : %{customdata:,}<extra></extra>",
+            "marker": {
+                "size": taille.tolist(),
+                "sizemode": "area",
+                "sizeref": 2.0 * taille.max() / 30 ** 2,
+                "sizemin": 2,
+                "color": "#007BFF",
+                "opacity": 0.6
+            }
+        }],
+        "layout": {
+            "title": {"text": f"Valeurs foncières vs Population — {annee}"},
+            "xaxis": {"type": "log", "title": {"text": f"Population {annee_pop} (échelle logarithmique)"}},
+            "yaxis": {"title": {"text": "Valeur foncière médiane (€)"}},
+            "template": TEMPLATE,
+            "height": 600,
+            "uirevision": "panel-communes"
+        }
+    }
+    return resume, fig
 
-    dcc.Graph(figure=fig_scatter)
-])
+
+@callback(
+    Output("panel-table", "data"),
+    Output("panel-table", "page_count"),
+    Input("panel-annee", "value"),
+    Input("panel-min-transactions", "value"),
+    Input("panel-table", "page_current"),
+    Input("panel-table", "page_size"),
+    Input("panel-table", "sort_by"),
+)
+def update_table(annee, min_transactions, page_current, page_size, sort_by):
+    communes = select(annee, min_transactions)
+    if sort_by:
+        communes = communes.sort_values(
+            sort_by[0]["column_id"], ascending=sort_by[0]["direction"] == "asc", kind="stable"
+        )
+    page_size = page_size or PAGE_SIZE
+    debut = (page_current or 0) * page_size
+    page = communes.iloc[debut:debut + page_size][list(COLONNES)].copy()
+    page["population"] = page["population"].astype(object).where(page["population"] >= 0, None)
+    page["Valeur_mediane"] = page["Valeur_mediane"].round(0)
+    page_count = max(1, -(-len(communes) // page_size))
+    return page.to_dict("records"), page_count
@@ -1,300 +1,287 @@
-import dash
 from dash import dcc, html
 import plotly.express as px
 import plotly.graph_objects as go
-from data_loader import load_all_data
+from data_loader import load_dataset, load_dep_stats
+from aggregations import fill_population
 import pandas as pd
 import numpy as np
 
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score, mean_absolute_error
+from figure_cache import cached_figures
 
-dash.register_page(__name__, path='/page4', suppress_callback_exceptions=True)
 
-# =============================
-# CHARGEMENT DES DONNÉES
-# =============================
-data = load_all_data()
-foncieres_all = data["foncieres_all"]
-pop_dep_all = data["pop_dep_all"]
-
-# =============================
-# AGRÉGATION PAR DÉPARTEMENT
-# =============================
-valeur_dep = (
-    foncieres_all
-    .groupby(["Code departement", "annee"])["Valeur fonciere"]
-    .agg(['median'])
-    .reset_index()
-)
-
-valeur_dep.columns = [
-    "Code_departement",
-    "annee",
-    "Valeur_mediane"
-]
-
-# Standardiser le format des codes départements
-valeur_dep['Code_departement'] = valeur_dep['Code_departement'].astype(str).str.zfill(2)
+def build_figures():
+    """Calcule les données de la page et construit ses figures Plotly."""
+    # =============================
+    # CHARGEMENT DES DONNÉES
+    # =============================
+    pop_dep_all = load_dataset("pop_dep_all")
 
-# =============================
-# STANDARDISATION DES DONNÉES DÉMOGRAPHIQUES
-# =============================
-pop_dep_clean = pop_dep_all.copy()
+    # =============================
+    # STANDARDISATION DES DONNÉES DÉMOGRAPHIQUES
+    # =============================
+    pop_dep_clean = pop_dep_all.copy()
 
-# Renommer si nécessaire pour assurer la cohérence
-if 'Code departement' in pop_dep_clean.columns:
-    pop_dep_clean = pop_dep_clean.rename(columns={'Code departement': 'Code_departement'})
+    # Renommer si nécessaire pour assurer la cohérence
+    if 'Code departement' in pop_dep_clean.columns:
+        pop_dep_clean = pop_dep_clean.rename(columns={'Code departement': 'Code_departement'})
 
-# Standardiser le format des codes départements
-pop_dep_clean['Code_departement'] = pop_dep_clean['Code_departement'].astype(str).str.zfill(2)
+    # Standardiser le format des codes départements
+    pop_dep_clean['Code_departement'] = pop_dep_clean['Code_departement'].astype(str).str.zfill(2)
 
-# =============================
-# FUSION DATA
-# =============================
-df_complet = pd.merge(
-    valeur_dep,
-    pop_dep_clean,
-    on=["Code_departement", "annee"],
-    how="inner"
-)
+    # =============================
+    # FUSION DATA
+    # =============================
+    # Table département × année partagée : médiane DVF + population déjà jointe
+    dep_stats = load_dep_stats()
+    if pop_dep_all is not None and len(pop_dep_all) > 0:
+        # Années sans estimation INSEE : dernière population connue
+        dep_stats = fill_population(dep_stats, pop_dep_all, method="locf")
+    dep_stats = dep_stats.rename(columns={"Code departement": "Code_departement"})
+    df_complet = dep_stats[dep_stats["Ensemble_Total"].notna()].copy()
 
-print(f"Dataset fusionné : {len(df_complet):,} observations")
+    print(f"Dataset fusionné : {len(df_complet):,} observations")
 
-# =============================
-# CALCUL DES PROPORTIONS
-# =============================
-# Vérifier que les colonnes nécessaires existent
-colonnes_requises = [
-    'Ensemble_20 à 39 ans',
-    'Ensemble_40 à 59 ans', 
-    'Ensemble_75 ans et plus',
-    'Ensemble_Total'
-]
-
-colonnes_manquantes = [col for col in colonnes_requises if col not in df_complet.columns]
-if colonnes_manquantes:
-    print(f"⚠️  Colonnes manquantes : {colonnes_manquantes}")
-    # Créer un graphique d'erreur
-    fig = go.Figure()
-    fig.add_annotation(
-        text=f"Erreur : colonnes de tranches d'âge manquantes<br>Assurez-vous d'utiliser data_loader_corrected.py",
-        xref="paper", yref="paper",
-        x=0.5, y=0.5, showarrow=False,
-        font=dict(size=16, color="red")
-    )
-    fig.update_layout(
-        title="Données incomplètes",
-        template="plotly_white",
-        height=600
-    )
-else:
-    # Convertir en numérique
-    for col in colonnes_requises:
-        df_complet[col] = pd.to_numeric(df_complet[col], errors='coerce')
-    
-    # Calculer les proportions
-    df_complet['prop_20_39'] = df_complet['Ensemble_20 à 39 ans'] / df_complet['Ensemble_Total']
-    df_complet['prop_40_59'] = df_complet['Ensemble_40 à 59 ans'] / df_complet['Ensemble_Total']
-    df_complet['prop_75_plus'] = df_complet['Ensemble_75 ans et plus'] / df_complet['Ensemble_Total']
-    
-    # Nettoyage
-    df_complet = df_complet.replace([np.inf, -np.inf], np.nan)
-    df_complet = df_complet.dropna(subset=[
-        'Valeur_mediane',
-        'Ensemble_Total',
-        'prop_20_39',
-        'prop_40_59',
-        'prop_75_plus'
-    ])
-    
-    print(f"Après nettoyage : {len(df_complet):,} observations")
-    
     # =============================
-    # TRAIN / TEST
+    # CALCUL DES PROPORTIONS
     # =============================
-    df_train = df_complet[df_complet['annee'] <= 2024].copy()
-    df_test_2025 = df_complet[df_complet['annee'] == 2025].copy()
-    
-    if len(df_train) == 0 or len(df_test_2025) == 0:
-        print(f"⚠️  Données insuffisantes - Train: {len(df_train)}, Test 2025: {len(df_test_2025)}")
+    # Vérifier que les colonnes nécessaires existent
+    colonnes_requises = [
+        'Ensemble_20 à 39 ans',
+        'Ensemble_40 à 59 ans', 
+        'Ensemble_75 ans et plus',
+        'Ensemble_Total'
+    ]
+
+    colonnes_manquantes = [col for col in colonnes_requises if col not in df_complet.columns]
+    if colonnes_manquantes:
+        print(f"⚠️  Colonnes manquantes : {colonnes_manquantes}")
+        # Créer un graphique d'erreur
         fig = go.Figure()
         fig.add_annotation(
-            text="Erreur : données insuffisantes pour l'entraînement",
+            text=f"Erreur : colonnes de tranches d'âge manquantes<br>Assurez-vous d'utiliser data_loader_corrected.py",
             xref="paper", yref="paper",
             x=0.5, y=0.5, showarrow=False,
             font=dict(size=16, color="red")
         )
-        fig.update_layout(title="Données insuffisantes", template="plotly_white", height=600)
+        fig.update_layout(
+            title="Données incomplètes",
+            template="plotly_white",
+            height=600
+        )
     else:
-        features = ['Ensemble_Total', 'prop_20_39', 'prop_40_59', 'prop_75_plus']
-        
-        X_train = df_train[features]
-        y_train = df_train['Valeur_mediane']
-        
-        X_test = df_test_2025[features]
-        y_test = df_test_2025['Valeur_mediane']
-        
-        # =============================
-        # MODÈLE
-        # =============================
-        model_pred = LinearRegression()
-        model_pred.fit(X_train, y_train)
-        
-        # =============================
-        # PRÉDICTION 2025
-        # =============================
-        y_pred_2025 = model_pred.predict(X_test)
-        
-        df_test_2025['Valeur_pred'] = y_pred_2025
-        df_test_2025['Erreur'] = df_test_2025['Valeur_mediane'] - df_test_2025['Valeur_pred']
-        df_test_2025['Erreur_pct'] = (
-            df_test_2025['Erreur'] / df_test_2025['Valeur_mediane']
-        ) * 100
-        
-        r2_2025 = r2_score(y_test, y_pred_2025)
-        mae_2025 = mean_absolute_error(y_test, y_pred_2025)
-        
-        print(f"Performance 2025 : R² = {r2_2025:.3f}, MAE = {mae_2025:,.0f}€")
-        
+        # Convertir en numérique
+        for col in colonnes_requises:
+            df_complet[col] = pd.to_numeric(df_complet[col], errors='coerce')
+
+        # Calculer les proportions
+        df_complet['prop_20_39'] = df_complet['Ensemble_20 à 39 ans'] / df_complet['Ensemble_Total']
+        df_complet['prop_40_59'] = df_complet['Ensemble_40 à 59 ans'] / df_complet['Ensemble_Total']
+        df_complet['prop_75_plus'] = df_complet['Ensemble_75 ans et plus'] / df_complet['Ensemble_Total']
+
+        # Nettoyage
+        df_complet = df_complet.replace([np.inf, -np.inf], np.nan)
+        df_complet = df_complet.dropna(subset=[
+            'Valeur_mediane',
+            'Ensemble_Total',
+            'prop_20_39',
+            'prop_40_59',
+            'prop_75_plus'
+        ])
+
+        print(f"Après nettoyage : {len(df_complet):,} observations")
+
         # =============================
-        # PRÉDICTIONS 2026
+        # TRAIN / TEST
         # =============================
-        df_2026 = pop_dep_clean[pop_dep_clean['annee'] == 2026].copy()
-        
-        if len(df_2026) > 0:
-            # Convertir en numérique
-            for col in colonnes_requises:
-                if col in df_2026.columns:
-                    df_2026[col] = pd.to_numeric(df_2026[col], errors='coerce')
-            
-            df_2026['prop_20_39'] = df_2026['Ensemble_20 à 39 ans'] / df_2026['Ensemble_Total']
-            df_2026['prop_40_59'] = df_2026['Ensemble_40 à 59 ans'] / df_2026['Ensemble_Total']
-            df_2026['prop_75_plus'] = df_2026['Ensemble_75 ans et plus'] / df_2026['Ensemble_Total']
-            
-            df_2026_clean = df_2026.dropna(subset=features).copy()
-            
-            if len(df_2026_clean) > 0:
-                X_2026 = df_2026_clean[features]
-                df_2026_clean['Valeur_pred_2026'] = model_pred.predict(X_2026)
-                
-                print(f"Prédictions 2026 : {len(df_2026_clean)} départements")
-                
-                # =============================
-                # COMPARAISON 2025 vs 2026
-                # =============================
-                df_compare = pd.merge(
-                    df_test_2025[['Code_departement', 'Valeur_mediane']],
-                    df_2026_clean[['Code_departement', 'Nom_departement', 'Valeur_pred_2026']],
-                    on='Code_departement',
-                    how='inner'
-                )
-                
-                # =============================
-                # AJOUT 2024
-                # =============================
-                df_2024 = df_complet[df_complet['annee'] == 2024][
-                    ['Code_departement', 'Valeur_mediane']
-                ].copy()
-                
-                df_2024 = df_2024.rename(columns={'Valeur_mediane': 'Valeur_2024'})
-                
-                df_compare_complet = pd.merge(
-                    df_2024,
-                    df_compare,
-                    on='Code_departement',
-                    how='inner'
-                )
-                
-                # Ajouter un index numérique pour l'axe X
-                df_compare_complet = df_compare_complet.reset_index(drop=True)
-                df_compare_complet['dept_index'] = range(len(df_compare_complet))
-                
-                # =============================
-                # FIGURE - AVEC LIGNES PAR DÉPARTEMENT
-                # =============================
-                fig = go.Figure()
-                
-                # Ajouter UNE LIGNE pour chaque département reliant les 3 années
-                for idx, row in df_compare_complet.iterrows():
-                    dept_idx = row['dept_index']
-                    
-                    # Une seule trace par département avec 3 points
+        df_train = df_complet[df_complet['annee'] <= 2024].copy()
+        df_test_2025 = df_complet[df_complet['annee'] == 2025].copy()
+
+        if len(df_train) == 0 or len(df_test_2025) == 0:
+            print(f"⚠️  Données insuffisantes - Train: {len(df_train)}, Test 2025: {len(df_test_2025)}")
+            fig = go.Figure()
+            fig.add_annotation(
+                text="Erreur : données insuffisantes pour l'entraînement",
+                xref="paper", yref="paper",
+                x=0.5, y=0.5, showarrow=False,
+                font=dict(size=16, color="red")
+            )
+            fig.update_layout(title="Données insuffisantes", template="plotly_white", height=600)
+        else:
+            features = ['Ensemble_Total', 'prop_20_39', 'prop_40_59', 'prop_75_plus']
+
+            X_train = df_train[features]
+            y_train = df_train['Valeur_mediane']
+
+            X_test = df_test_2025[features]
+            y_test = df_test_2025['Valeur_mediane']
+
+            # =============================
+            # MODÈLE
+            # =============================
+            model_pred = LinearRegression()
+            model_pred.fit(X_train, y_train)
+
+            # =============================
+            # PRÉDICTION 2025
+            # =============================
+            y_pred_2025 = model_pred.predict(X_test)
+
+            df_test_2025['Valeur_pred'] = y_pred_2025
+            df_test_2025['Erreur'] = df_test_2025['Valeur_mediane'] - df_test_2025['Valeur_pred']
+            df_test_2025['Erreur_pct'] = (
+                df_test_2025['Erreur'] / df_test_2025['Valeur_mediane']
+            ) * 100
+
+            r2_2025 = r2_score(y_test, y_pred_2025)
+            mae_2025 = mean_absolute_error(y_test, y_pred_2025)
+
+            print(f"Performance 2025 : R² = {r2_2025:.3f}, MAE = {mae_2025:,.0f}€")
+
+            # =============================
+            # PRÉDICTIONS 2026
+            # =============================
+            df_2026 = pop_dep_clean[pop_dep_clean['annee'] == 2026].copy()
+
+            if len(df_2026) > 0:
+                # Convertir en numérique
+                for col in colonnes_requises:
+                    if col in df_2026.columns:
+                        df_2026[col] = pd.to_numeric(df_2026[col], errors='coerce')
+
+                df_2026['prop_20_39'] = df_2026['Ensemble_20 à 39 ans'] / df_2026['Ensemble_Total']
+                df_2026['prop_40_59'] = df_2026['Ensemble_40 à 59 ans'] / df_2026['Ensemble_Total']
+                df_2026['prop_75_plus'] = df_2026['Ensemble_75 ans et plus'] / df_2026['Ensemble_Total']
+
+                df_2026_clean = df_2026.dropna(subset=features).copy()
+
+                if len(df_2026_clean) > 0:
+                    X_2026 = df_2026_clean[features]
+                    df_2026_clean['Valeur_pred_2026'] = model_pred.predict(X_2026)
+
+                    print(f"Prédictions 2026 : {len(df_2026_clean)} départements")
+
+                    # =============================
+                    # COMPARAISON 2025 vs 2026
+                    # =============================
+                    df_compare = pd.merge(
+                        df_test_2025[['Code_departement', 'Valeur_mediane']],
+                        df_2026_clean[['Code_departement', 'Nom_departement', 'Valeur_pred_2026']],
+                        on='Code_departement',
+                        how='inner'
+                    )
+
+                    # =============================
+                    # AJOUT 2024
+                    # =============================
+                    df_2024 = df_complet[df_complet['annee'] == 2024][
+                        ['Code_departement', 'Valeur_mediane']
+                    ].copy()
+
+                    df_2024 = df_2024.rename(columns={'Valeur_mediane': 'Valeur_2024'})
+
+                    df_compare_complet = pd.merge(
+                        df_2024,
+                        df_compare,
+                        on='Code_departement',
+                        how='inner'
+                    )
+
+                    # Ajouter un index numérique pour l'axe X
+                    df_compare_complet = df_compare_complet.reset_index(drop=True)
+                    df_compare_complet['dept_index'] = range(len(df_compare_complet))
+
+                    # =============================
+                    # FIGURE - AVEC LIGNES PAR DÉPARTEMENT
+                    # =============================
+                    fig = go.Figure()
+
+                    # Ajouter UNE LIGNE pour chaque département reliant les 3 années
+                    for idx, row in df_compare_complet.iterrows():
+                        dept_idx = row['dept_index']
+
+                        # Une seule trace par département avec 3 points
+                        fig.add_trace(go.Scatter(
+                            x=[dept_idx, dept_idx, dept_idx],
+                            y=[row['Valeur_2024'], row['Valeur_mediane'], row['Valeur_pred_2026']],
+                            mode='lines+markers',
+                            line=dict(color='lightgray', width=1),
+                            marker=dict(size=0),  # Marqueurs invisibles pour la ligne
+                            showlegend=False,
+                            hoverinfo='skip',
+                            name=''
+                        ))
+
+                    # Points 2024 par-dessus les lignes
                     fig.add_trace(go.Scatter(
-                        x=[dept_idx, dept_idx, dept_idx],
-                        y=[row['Valeur_2024'], row['Valeur_mediane'], row['Valeur_pred_2026']],
-                        mode='lines+markers',
-                        line=dict(color='lightgray', width=1),
-                        marker=dict(size=0),  # Marqueurs invisibles pour la ligne
-                        showlegend=False,
-                        hoverinfo='skip',
-                        name=''
+                        x=df_compare_complet['dept_index'],
+                        y=df_compare_complet['Valeur_2024'],
+                        mode='markers',
+                        name='2024 (réel)',
+                        marker=dict(size=8, color='lightblue'),
+                        text=df_compare_complet['Nom_departement'],
+                        hovertemplate='<b>%{text}</b><br>2024: %{y:,.0f}€<extra></extra>'
                     ))
-                
-                # Points 2024 par-dessus les lignes
-                fig.add_trace(go.Scatter(
-                    x=df_compare_complet['dept_index'],
-                    y=df_compare_complet['Valeur_2024'],
-                    mode='markers',
-                    name='2024 (réel)',
-                    marker=dict(size=8, color='lightblue'),
-                    text=df_compare_complet['Nom_departement'],
-                    hovertemplate='<b>%{text}</b><br>2024: %{y:,.0f}€<extra></extra>'
-                ))
-                
-                # Points 2025
-                fig.add_trace(go.Scatter(
-                    x=df_compare_complet['dept_index'],
-                    y=df_compare_complet['Valeur_mediane'],
-                    mode='markers',
-                    name='2025 (réel)',
-                    marker=dict(size=8, color='steelblue'),
-                    text=df_compare_complet['Nom_departement'],
-                    hovertemplate='<b>%{text}</b><br>2025: %{y:,.0f}€<extra></extra>'
-                ))
-                
-                # Points 2026
-                fig.add_trace(go.Scatter(
-                    x=df_compare_complet['dept_index'],
-                    y=df_compare_complet['Valeur_pred_2026'],
-                    mode='markers',
-                    name='2026 (prédit)',
-                    marker=dict(size=8, color='coral'),
-                    text=df_compare_complet['Nom_departement'],
-                    hovertemplate='<b>%{text}</b><br>2026: %{y:,.0f}€<extra></extra>'
-                ))
-                
-                fig.update_layout(
-                    title=f"Évolution des valeurs foncières en 2024, 2025 (réels) et 2026 (prédit)",
-                    xaxis_title='Département',
-                    yaxis_title='Valeur médiane (€)',
-                    height=600,
-                    template='plotly_white',
-                    xaxis={'showticklabels': False},
-                    hovermode='closest',
-                    showlegend=True
-                )
-                
+
+                    # Points 2025
+                    fig.add_trace(go.Scatter(
+                        x=df_compare_complet['dept_index'],
+                        y=df_compare_complet['Valeur_mediane'],
+                        mode='markers',
+                        name='2025 (réel)',
+                        marker=dict(size=8, color='steelblue'),
+                        text=df_compare_complet['Nom_departement'],
+                        hovertemplate='<b>%{text}</b><br>2025: %{y:,.0f}€<extra></extra>'
+                    ))
+
+                    # Points 2026
+                    fig.add_trace(go.Scatter(
+                        x=df_compare_complet['dept_index'],
+                        y=df_compare_complet['Valeur_pred_2026'],
+                        mode='markers',
+                        name='2026 (prédit)',
+                        marker=dict(size=8, color='coral'),
+                        text=df_compare_complet['Nom_departement'],
+                        hovertemplate='<b>%{text}</b><br>2026: %{y:,.0f}€<extra></extra>'
+                    ))
+
+                    fig.update_layout(
+                        title=f"Évolution des valeurs foncières en 2024, 2025 (réels) et 2026 (prédit)",
+                        xaxis_title='Département',
+                        yaxis_title='Valeur médiane (€)',
+                        height=600,
+                        template='plotly_white',
+                        xaxis={'showticklabels': False},
+                        hovermode='closest',
+                        showlegend=True
+                    )
+
+                else:
+                    print("⚠️  Aucune donnée 2026 valide après nettoyage")
+                    fig = go.Figure()
+                    fig.add_annotation(
+                        text="Pas de données 2026 disponibles",
+                        xref="paper", yref="paper",
+                        x=0.5, y=0.5, showarrow=False,
+                        font=dict(size=16)
+                    )
+                    fig.update_layout(title="Données 2026 manquantes", template="plotly_white", height=600)
             else:
-                print("⚠️  Aucune donnée 2026 valide après nettoyage")
+                print("⚠️  Aucune donnée démographique pour 2026")
                 fig = go.Figure()
                 fig.add_annotation(
-                    text="Pas de données 2026 disponibles",
+                    text="Pas de données démographiques pour 2026",
                     xref="paper", yref="paper",
                     x=0.5, y=0.5, showarrow=False,
                     font=dict(size=16)
                 )
                 fig.update_layout(title="Données 2026 manquantes", template="plotly_white", height=600)
-        else:
-            print("⚠️  Aucune donnée démographique pour 2026")
-            fig = go.Figure()
-            fig.add_annotation(
-                text="Pas de données démographiques pour 2026",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5, showarrow=False,
-                font=dict(size=16)
-            )
-            fig.update_layout(title="Données 2026 manquantes", template="plotly_white", height=600)
+
+    return {"fig": fig}
+
+
+figures = cached_figures("page4", build_figures)
 
 # =============================
 # LAYOUT DASH
@@ -302,5 +289,5 @@ else:
 layout = html.Div([
     html.H1("Prédiction des prix immobiliers 2026"),
 
-    dcc.Graph(figure=fig)
+    dcc.Graph(figure=figures["fig"])
 ])
\ No newline at end of file
@@ -0,0 +1,85 @@
+from dash import dcc, html
+import plotly.express as px
+import plotly.graph_objects as go
+from data_loader import load_dataset, load_price_m2_stats
+from figure_cache import cached_figures
+import numpy as np
+
+
+def build_figures():
+    """Calcule les données de la page et construit ses figures Plotly."""
+    # =============================
+    # CHARGEMENT DES DONNÉES
+    # =============================
+    communes_geo = load_dataset("communes_geo")
+
+    # =============================
+    # AGRÉGATION PAR COMMUNE (TOUTES ANNÉES)
+    # =============================
+    # Prix au m² médian sur la période : valeur / surface bâtie de chaque
+    # mutation, terrains nus écartés (les valeurs totales mêleraient terrains,
+    # appartements et immeubles entiers sur une même échelle)
+    stats = load_price_m2_stats(["code_insee"])
+    stats = stats[stats["code_insee"] >= 0]
+    df_communes = stats.merge(communes_geo, on="code_insee", how="inner")
+    print(f"✓ Carte communale : {len(df_communes):,} communes localisées sur {len(stats):,}")
+
+    # =============================
+    # FIGURE — CARTE DES COMMUNES (WEBGL)
+    # =============================
+    # Un polygone par commune (35 000) serait trop lourd à dessiner : chaque
+    # commune est un point placé sur son centre, rendu en WebGL par MapLibre.
+    if len(df_communes) == 0:
+        fig = go.Figure()
+        fig.add_annotation(
+            text="Coordonnées des communes non disponibles (data/communes-france*.csv)",
+            xref="paper", yref="paper",
+            x=0.5, y=0.5, showarrow=False,
+            font=dict(size=16)
+        )
+        fig.update_layout(title="Carte communale indisponible", template="plotly_white", height=600)
+        return {"fig": fig}
+
+    # Échelle de couleurs bornée aux 5e et 95e centiles (prix extrêmes)
+    bornes = np.nanpercentile(df_communes["Valeur_mediane"], [5, 95])
+
+    fig = px.scatter_map(
+        df_communes,
+        lat="latitude",
+        lon="longitude",
+        color="Valeur_mediane",
+        size="Nb_transactions",
+        hover_name="nom_commune",
+        hover_data={
+            "Valeur_mediane": ":,.0f",
+            "Nb_transactions": ":,.0f",
+            "latitude": False,
+            "longitude": False
+        },
+        labels={
+            "Valeur_mediane": "Prix médian (€/m²)",
+            "Nb_transactions": "Ventes avec surface bâtie"
+        },
+        color_continuous_scale="YlOrRd",
+        range_color=tuple(bornes),
+        size_max=14,
+        zoom=4.6,
+        center={"lat": 46.6, "lon": 2.4},
+        map_style="carto-positron",
+        height=800
+    )
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0}, uirevision="carte-communes")
+
+    return {"fig": fig}
+
+
+figures = cached_figures("page5", build_figures)
+
+# =============================
+# LAYOUT DASH
+# =============================
+layout = html.Div([
+    html.H1("Prix médian au m² par commune"),
+
+    dcc.Graph(figure=figures["fig"])
+])
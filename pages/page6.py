@@ -0,0 +1,166 @@
+from dash import dcc, html, callback, Input, Output
+import plotly.io as pio
+from data_loader import dvf_years
+from query_index import TYPES, get_index
+
+from pages.constants import DEPT_NAMES
+
+# =============================
+# PAGE D'EXPLORATION (FILTRES INTERACTIFS)
+# =============================
+# Aucune donnée n'est chargée à l'import : le module est importé au
+# démarrage de l'appli pour enregistrer ses callbacks, et chaque callback
+# interroge l'index trié de query_index (quelques dizaines de ms).
+
+# Les figures sont renvoyées en dictionnaires : la validation des objets
+# Plotly coûterait plus cher que la requête elle-même
+TEMPLATE = pio.templates["plotly_white"].to_plotly_json()
+
+
+def warm_up():
+    """Construit (ou ouvre) l'index de requête avant la première visite."""
+    get_index()
+
+
+def empty_figure(message):
+    return {
+        "data": [],
+        "layout": {
+            "annotations": [{
+                "text": message, "xref": "paper", "yref": "paper",
+                "x": 0.5, "y": 0.5, "showarrow": False, "font": {"size": 16}
+            }],
+            "template": TEMPLATE,
+            "height": 450
+        }
+    }
+
+
+# =============================
+# LAYOUT DASH
+# =============================
+def layout():
+    """Layout recalculé à chaque visite : les années suivent les données rafraîchies."""
+    annees = dvf_years()
+    return html.Div([
+        html.H1("Explorer les transactions"),
+
+        html.Div([
+            html.Label("Années"),
+            dcc.RangeSlider(
+                id="filtre-annees",
+                min=annees[0], max=annees[-1], step=1,
+                value=[annees[0], annees[-1]],
+                marks={a: str(a) for a in annees}
+            ),
+
+            html.Label("Départements"),
+            dcc.Dropdown(
+                id="filtre-departements",
+                options=[{"label": f"{code} — {nom}", "value": code} for code, nom in DEPT_NAMES.items()],
+                multi=True,
+                placeholder="Tous les départements"
+            ),
+
+            html.Label("Types de local"),
+            dcc.Dropdown(
+                id="filtre-types",
+                options=[{"label": t, "value": t} for t in TYPES],
+                multi=True,
+                placeholder="Tous les types"
+            ),
+
+            html.Label("Fourchette de prix (€)"),
+            html.Div([
+                dcc.Input(id="filtre-prix-min", type="number", min=0, placeholder="minimum", debounce=True),
+                dcc.Input(id="filtre-prix-max", type="number", min=0, placeholder="maximum", debounce=True),
+            ]),
+        ], style={"maxWidth": "900px", "margin": "20px 0"}),
+
+        html.Div(id="exploration-resume", style={"fontSize": "18px", "margin": "10px 0"}),
+
+        dcc.Graph(id="exploration-departements"),
+
+        html.Hr(),
+
+        dcc.Graph(id="exploration-annees")
+    ])
+
+
+# =============================
+# CALLBACK
+# =============================
+@callback(
+    Output("exploration-resume", "children"),
+    Output("exploration-departements", "figure"),
+    Output("exploration-annees", "figure"),
+    Input("filtre-annees", "value"),
+    Input("filtre-departements", "value"),
+    Input("filtre-types", "value"),
+    Input("filtre-prix-min", "value"),
+    Input("filtre-prix-max", "value"),
+)
+def update_exploration(annees, departements, types, prix_min, prix_max):
+    index = get_index()
+    filtres = dict(
+        depts=departements or None,
+        years=tuple(annees) if annees else None,
+        prix=(prix_min, prix_max),
+        types=types or None,
+    )
+
+    total = index.stats(**filtres, quantiles=(0.5, 0.10, 0.90))
+    if len(total) == 0:
+        message = "Aucune transaction ne correspond à ces filtres"
+        return message, empty_figure(message), empty_figure(message)
+
+    ligne = total.iloc[0]
+    resume = (
+        f"{ligne['Nb_transactions']:,.0f} transactions — médiane {ligne['Valeur_mediane']:,.0f} € "
+        f"(10 % : {ligne['Valeur_q10']:,.0f} €, 90 % : {ligne['Valeur_q90']:,.0f} €)"
+    )
+
+    # Médiane par département
+    par_dep = index.stats(by="Code departement", **filtres).sort_values("Valeur_mediane")
+    noms = [DEPT_NAMES.get(code, code) for code in par_dep["Code departement"]]
+    fig_dep = {
+        "data": [{
+            "type": "bar",
+            "x": par_dep["Valeur_mediane"].tolist(),
+            "y": noms,
+            "orientation": "h",
+            "customdata": list(zip(par_dep["Code departement"], par_dep["Nb_transactions"].tolist())),
+            "hovertemplate": "%{y} (%{customdata[0]})<br>Médiane : %{x:,.0f} €"
+                             "<br>Transactions : %{customdata[1]:,}<extra></extra>",
+            "marker": {"color": "#007BFF"}
+        }],
+        "layout": {
+            "title": {"text": "Valeur foncière médiane par département"},
+            "xaxis": {"title": {"text": "Valeur médiane (€)"}},
+            "template": TEMPLATE,
+            "height": max(450, 18 * len(par_dep))
+        }
+    }
+
+    # Médiane par année (bande interquartile)
+    par_annee = index.stats(by="annee", **filtres, quantiles=(0.5, 0.25, 0.75))
+    x = par_annee["annee"].tolist()
+    fig_annee = {
+        "data": [
+            {"type": "scatter", "x": x, "y": par_annee["Valeur_q75"].tolist(), "mode": "lines",
+             "line": {"width": 0}, "showlegend": False, "hoverinfo": "skip"},
+            {"type": "scatter", "x": x, "y": par_annee["Valeur_q25"].tolist(), "mode": "lines",
+             "fill": "tonexty", "line": {"width": 0}, "fillcolor": "rgba(0,123,255,0.2)",
+             "name": "25 % – 75 %"},
+            {"type": "scatter", "x": x, "y": par_annee["Valeur_mediane"].tolist(), "mode": "lines+markers",
+             "line": {"color": "#007BFF"}, "name": "Médiane"},
+        ],
+        "layout": {
+            "title": {"text": "Évolution de la valeur foncière"},
+            "xaxis": {"title": {"text": "Année"}, "dtick": 1},
+            "yaxis": {"title": {"text": "Valeur (€)"}},
+            "template": TEMPLATE,
+            "height": 450
+        }
+    }
+    return resume, fig_dep, fig_annee
@@ -0,0 +1,317 @@
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+import data_store
+from data_loader import DEPT_CODES, TYPES_LOCAL, dept_dtype, ensure_cache, load_foncieres, type_local_dtype
+
+# =============================
+# INDEX DE REQUÊTE (FILTRES INTERACTIFS)
+# =============================
+# Les transactions sont rangées par cellule (département × année × type de
+# local) puis par valeur, dans un seul tableau de clés float64 :
+#     clé = cellule × KEY_SCALE + valeur
+# Une table d'offsets donne la tranche de chaque cellule. Un filtre
+# (départements, années, types, fourchette de prix) se réduit donc à une tranche
+# contiguë par cellule, trouvée par recherche dichotomique, sans parcourir
+# les 20 millions de lignes.
+#
+# Pour les quantiles exacts d'une réunion de tranches, les valeurs sont
+# découpées en N_EDGES intervalles communs à toutes les cellules (bornes =
+# quantiles de l'ensemble des valeurs) et `bounds` donne, pour chaque
+# cellule, la position de chaque borne dans sa tranche. Le rang cherché
+# tombe dans un intervalle trouvé par simple somme de ces positions ; seules
+# les valeurs de cet intervalle (≈ 1/N_EDGES du groupe) sont relues puis
+# triées. Tous les rangs de tous les groupes sont traités ensemble.
+#
+# L'index est écrit une fois par version du cache (data/cache/index/) et
+# ouvert en memmap par chaque worker.
+
+KEY_SCALE = 1e10  # valeurs plafonnées à 10 Md€ ; précision de la clé ≈ 0,004 €
+N_EDGES = 1024
+INDEX_FORMAT = 2  # à incrémenter quand les fichiers de l'index changent
+
+# Types de local de l'index : ceux de DVF, plus les mutations sans local bâti
+TYPES = TYPES_LOCAL + ["Sans local"]
+
+index_dir = os.path.join(data_store.store_dir, "index")
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def build_index(foncieres):
+    """Clés triées, offsets, bornes d'intervalles et positions des bornes par cellule."""
+    dept = pd.Categorical(foncieres["Code departement"], dtype=dept_dtype).codes.astype(np.int64)
+    annee = foncieres["annee"].to_numpy().astype(np.int64)
+    valeur = foncieres["Valeur fonciere"].to_numpy(dtype=np.float64)
+    type_local = pd.Categorical(foncieres["Type local"], dtype=type_local_dtype).codes.astype(np.int64)
+    type_local[type_local < 0] = len(TYPES) - 1
+
+    valid = (dept >= 0) & ~np.isnan(valeur)
+    if not valid.any():
+        return (np.array([], dtype=np.float64), np.zeros(1, dtype=np.int64), [],
+                np.array([], dtype=np.float64), np.zeros((0, 0), dtype=np.int32))
+    years = list(range(int(annee[valid].min()), int(annee[valid].max()) + 1))
+
+    valeur = np.clip(valeur[valid], 0, KEY_SCALE - 1)
+    cell = (dept[valid] * len(years) + (annee[valid] - years[0])) * len(TYPES) + type_local[valid]
+    keys = cell * KEY_SCALE + valeur
+    keys.sort()  # tri par cellule puis par valeur
+    n_cells = len(DEPT_CODES) * len(years) * len(TYPES)
+    counts = np.bincount(cell, minlength=n_cells)
+    offsets = np.r_[0, np.cumsum(counts)].astype(np.int64)
+
+    # Bornes : quantiles d'un échantillon régulier des valeurs
+    sample = np.sort(valeur[::max(1, len(valeur) // 1_000_000)])
+    edges = np.unique(sample[np.linspace(0, len(sample) - 1, N_EDGES + 2).astype(np.int64)[1:-1]])
+    # bounds[c, j] : nombre de valeurs de la cellule c inférieures ou égales à edges[j]
+    needles = np.arange(n_cells)[:, None] * KEY_SCALE + edges[None, :]
+    bounds = (np.searchsorted(keys, needles.ravel(), side="right").reshape(needles.shape)
+              - offsets[:-1, None]).astype(np.int32)
+    return keys, offsets, years, edges, bounds
+
+
+def _write_index(path, keys, offsets, years, edges, bounds):
+    tmp = f"{path}.tmp{os.getpid()}"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, "keys.npy"), keys)
+    np.save(os.path.join(tmp, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp, "edges.npy"), edges)
+    np.save(os.path.join(tmp, "bounds.npy"), bounds)
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"years": years, "depts": DEPT_CODES, "types": TYPES}, f)
+    os.replace(tmp, path)
+
+
+def get_index():
+    """Index de la version courante du cache (construit au premier appel)."""
+    version = data_store.dataset_version() or ensure_cache()["version"]
+    index = _indexes.get(version)
+    if index is not None:
+        return index
+
+    with _lock, data_store.store_lock("index"):
+        index = _indexes.get(version)
+        if index is not None:
+            return index
+        name = f"{version}.v{INDEX_FORMAT}"
+        path = os.path.join(index_dir, name)
+        if not os.path.exists(path):
+            print("Construction de l'index de requête...")
+            foncieres = load_foncieres(columns=["Code departement", "annee", "Valeur fonciere", "Type local"])
+            _write_index(path, *build_index(foncieres))
+            for old in os.listdir(index_dir):
+                if old != name and ".tmp" not in old:
+                    shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = DvfIndex(
+            np.load(os.path.join(path, "keys.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "offsets.npy")),
+            meta["years"],
+            np.load(os.path.join(path, "edges.npy")),
+            np.load(os.path.join(path, "bounds.npy"), mmap_mode="r"),
+            meta["depts"],
+            meta["types"],
+        )
+        _indexes.clear()
+        _indexes[version] = index
+    return index
+
+
+class DvfIndex:
+    """Transactions triées par (département, année, type de local, valeur) avec table d'offsets."""
+
+    def __init__(self, keys, offsets, years, edges, bounds, depts=DEPT_CODES, types=TYPES):
+        self.keys = keys
+        self.offsets = offsets
+        self.years = list(years)
+        self.edges = edges
+        self.bounds = bounds
+        self.depts = list(depts)
+        self.types = list(types)
+        self._last_below = None
+        self._bounds_dept_year = None
+
+    def select(self, depts=None, years=None, prix=None, types=None):
+        """Cellules retenues et tranche [start, end) de chacune après filtre de prix.
+
+        `years` est une paire (min, max) incluse ; `prix` une paire (min, max)
+        dont chaque borne peut être None ; `types` une liste de TYPES.
+        """
+        n_years = len(self.years)
+        n_types = len(self.types)
+        dept_ids = np.arange(len(self.depts)) if not depts else dept_dtype.categories.get_indexer(list(depts))
+        dept_ids = dept_ids[dept_ids >= 0]
+        if years:
+            lo_year, hi_year = years
+        else:
+            lo_year, hi_year = (self.years[0], self.years[-1]) if self.years else (0, -1)
+        year_ids = np.array(
+            [y - self.years[0] for y in self.years if lo_year <= y <= hi_year], dtype=np.int64
+        )
+        type_ids = np.arange(n_types) if not types else pd.Index(self.types).get_indexer(list(types))
+        type_ids = type_ids[type_ids >= 0]
+        cell = (dept_ids[:, None] * n_years + year_ids[None, :]).ravel().astype(np.int64)
+        cell = (cell[:, None] * n_types + type_ids[None, :]).ravel()
+
+        start = self.offsets[cell]
+        end = self.offsets[cell + 1]
+        pmin, pmax = prix if prix else (None, None)
+        base = cell * KEY_SCALE
+        if pmin is not None:
+            start = np.clip(np.searchsorted(self.keys, base + max(pmin, 0), side="left"), start, end)
+        if pmax is not None:
+            end = np.clip(np.searchsorted(self.keys, base + pmax, side="right"), start, end)
+        return cell, start, end
+
+    def cell_labels(self, cell):
+        """Code département et année de chaque cellule."""
+        n_years = len(self.years)
+        dept_year = cell // len(self.types)
+        depts = np.asarray(self.depts, dtype=object)[dept_year // n_years]
+        annees = np.asarray(self.years)[dept_year % n_years]
+        return depts, annees
+
+    def _cell_below(self, cell, start, end):
+        """Nombre de valeurs de chaque tranche inférieures ou égales à chaque borne (int32).
+
+        Les callbacks interrogent plusieurs fois les mêmes tranches (total, par
+        département, par année) : le dernier résultat est gardé.
+        """
+        key = (cell.tobytes(), start.tobytes(), end.tobytes())
+        last = self._last_below
+        if last is not None and last[0] == key:
+            return last[1]
+        cell_start = self.offsets[cell]
+        below = np.asarray(self.bounds[cell])
+        if not (np.array_equal(start, cell_start) and np.array_equal(end, self.offsets[cell + 1])):
+            below = below - (start - cell_start).astype(np.int32)[:, None]
+            np.maximum(below, 0, out=below)
+            np.minimum(below, (end - start).astype(np.int32)[:, None], out=below)
+        self._last_below = (key, below)
+        return below
+
+    def _dept_year_bounds(self):
+        """Positions des bornes sommées sur les types de local (une ligne par département × année)."""
+        if self._bounds_dept_year is None:
+            n_types = len(self.types)
+            self._bounds_dept_year = np.asarray(self.bounds).reshape(-1, n_types, len(self.edges)).sum(
+                axis=1, dtype=np.int32
+            )
+        return self._bounds_dept_year
+
+    def _group_below(self, cell, start, end, labels, n_groups, all_types):
+        """Nombre de valeurs ≤ chaque borne dans chaque groupe (n_groups × N_EDGES)."""
+        whole = np.array_equal(start, self.offsets[cell]) and np.array_equal(end, self.offsets[cell + 1])
+        if whole and all_types:
+            # Sans filtre de type ni de prix, les cinq types d'un département ×
+            # année sont pris entiers : lignes déjà sommées, cinq fois moins nombreuses
+            dept_year, first_cell = np.unique(cell // len(self.types), return_index=True)
+            rows, labels = self._dept_year_bounds()[dept_year], labels[first_cell]
+        else:
+            rows = self._cell_below(cell, start, end)
+        # Une somme par groupe : bien plus rapide que reduceat le long des lignes
+        if n_groups == 1:
+            return rows.sum(axis=0, dtype=np.int64)[None, :]
+        order = np.argsort(labels, kind="stable")
+        first = np.searchsorted(labels[order], np.arange(n_groups + 1))
+        return np.array([
+            rows[order[a:b]].sum(axis=0, dtype=np.int64) for a, b in zip(first[:-1], first[1:])
+        ]).reshape(n_groups, len(self.edges))
+
+    def _rank_values(self, cell, start, end, labels, n_groups, group, rank, all_types=False):
+        """Valeur de rang `rank` (0 = minimum) dans le groupe `group`, pour chaque demande.
+
+        `labels` donne le groupe de chaque tranche [start, end) ; toutes les
+        demandes (groupes × rangs) sont résolues en un seul passage.
+        `all_types` : tous les types de local sont retenus.
+        """
+        n_edges = len(self.edges)
+        below = self._group_below(cell, start, end, labels, n_groups, all_types)
+        order = np.argsort(labels, kind="stable")
+        cell, start, end, labels = cell[order], start[order], end[order], labels[order]
+        first = np.searchsorted(labels, np.arange(n_groups + 1))
+        cell_start = self.offsets[cell]
+
+        # Intervalle de chaque demande : première borne dont l'effectif dépasse le rang
+        rank = rank.astype(np.int64)
+        bucket = (below[group] <= rank[:, None]).sum(axis=1)
+        before = np.where(bucket > 0, below[group, np.maximum(bucket - 1, 0)], 0)
+
+        # Valeurs de chaque couple (groupe, intervalle) distinct, relues tranche par tranche
+        pairs, inverse = np.unique(group * (n_edges + 1) + bucket, return_inverse=True)
+        pair_group, pair_bucket = pairs // (n_edges + 1), pairs % (n_edges + 1)
+        sizes = first[pair_group + 1] - first[pair_group]
+        row = np.repeat(first[pair_group] - np.r_[0, np.cumsum(sizes)[:-1]], sizes) + np.arange(sizes.sum())
+        row_bucket = np.repeat(pair_bucket, sizes)
+        row_cell = cell[row]
+        size = self.offsets[row_cell + 1] - cell_start[row]
+        if n_edges:
+            lo = np.where(row_bucket > 0, self.bounds[row_cell, np.maximum(row_bucket - 1, 0)], 0)
+            hi = np.where(row_bucket < n_edges, self.bounds[row_cell, np.minimum(row_bucket, n_edges - 1)], size)
+        else:
+            lo, hi = np.zeros_like(size), size
+        lo = np.clip(cell_start[row] + lo, start[row], end[row])
+        hi = np.clip(cell_start[row] + hi, start[row], end[row])
+
+        lengths = hi - lo
+        total = int(lengths.sum())
+        positions = np.repeat(lo - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(total)
+        values = np.asarray(self.keys[positions]) - np.repeat(row_cell * KEY_SCALE, lengths)
+        # Les valeurs de chaque couple se suivent : tri sur place de chaque segment
+        pair_first = np.r_[0, np.cumsum(np.add.reduceat(lengths, np.r_[0, np.cumsum(sizes)[:-1]]))]
+        for a, b in zip(pair_first[:-1], pair_first[1:]):
+            values[a:b].sort()
+
+        position = pair_first[inverse] + rank - before
+        valid = position < pair_first[inverse + 1]
+        result = np.full(len(group), np.nan)
+        result[valid] = values[position[valid]]
+        return result
+
+    def stats(self, by=None, depts=None, years=None, prix=None, types=None, quantiles=(0.5,)):
+        """Effectif et quantiles exacts par département, par année ou au total.
+
+        `by` vaut "Code departement", "annee" ou None ; les quantiles sont
+        interpolés linéairement entre deux rangs, comme pandas.
+        """
+        cell, start, end = self.select(depts, years, prix, types)
+        nonempty = end > start
+        cell, start, end = cell[nonempty], start[nonempty], end[nonempty]
+        dept_labels, year_labels = self.cell_labels(cell)
+        if by is None:
+            labels = np.zeros(len(cell), dtype=np.int64)
+            keys = np.array(["Total"] if len(cell) else [], dtype=object)
+        else:
+            keys, labels = np.unique(dept_labels if by == "Code departement" else year_labels, return_inverse=True)
+
+        n_groups = len(keys)
+        counts = np.bincount(labels, weights=end - start, minlength=n_groups).astype(np.int64)
+        result = pd.DataFrame({by or "groupe": keys, "Nb_transactions": counts})
+        if n_groups == 0 or not quantiles:
+            for q in quantiles:
+                result["Valeur_mediane" if q == 0.5 else f"Valeur_q{int(round(q * 100))}"] = np.nan
+            return result
+
+        # Rangs inférieur et supérieur de chaque quantile, demandés en une fois
+        ranks = np.array([q * np.maximum(counts - 1, 0) for q in quantiles])
+        lo_rank = np.floor(ranks)
+        hi_rank = np.ceil(ranks)
+        group = np.tile(np.arange(n_groups), 2 * len(quantiles))
+        values = self._rank_values(
+            cell, start, end, labels, n_groups, group, np.r_[lo_rank.ravel(), hi_rank.ravel()],
+            all_types=not types or set(self.types) <= set(types),
+        ).reshape(2, len(quantiles), n_groups)
+        for i, q in enumerate(quantiles):
+            v_lo, v_hi = values[0, i], values[1, i]
+            name = "Valeur_mediane" if q == 0.5 else f"Valeur_q{int(round(q * 100))}"
+            result[name] = v_lo + (v_hi - v_lo) * (ranks[i] - lo_rank[i])
+        return result
@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# =============================
+# SKETCHES DE QUANTILES
+# =============================
+# Chaque cellule département × commune × année × mois est résumée par un
+# histogramme à intervalles logarithmiques (principe du DDSketch) : la valeur v
+# tombe dans l'intervalle i tel que γ^(i-1) < v ≤ γ^i. Deux sketches se
+# fusionnent en additionnant leurs effectifs, donc n'importe quelle réunion
+# de cellules (toutes les années d'une commune, un département sur un
+# trimestre...) donne ses quantiles sans relire les transactions, avec une
+# erreur relative bornée par RELATIVE_ACCURACY.
+#
+# Le jeu "sketches" est stocké en format creux : une ligne par cellule et
+# intervalle non vide (colonnes SKETCH_KEYS + bucket + n).
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = np.log(GAMMA)
+
+SKETCH_KEYS = ["Code departement", "code_insee", "annee", "mois"]
+QUANTILES = (0.10, 0.25, 0.75, 0.90)
+
+# DVF_EXACT_QUANTILES=1 : les pages recalculent les quantiles sur les transactions
+exact_quantiles = os.environ.get("DVF_EXACT_QUANTILES", "0") == "1"
+
+# Largeur (en bits) de chaque champ de la clé entière utilisée pour le comptage
+_BITS = {"code_insee": 17, "annee": 8, "mois": 4, "bucket": 11}
+_YEAR_BASE = 1900
+
+# Au-delà de ce nombre de cases groupe × intervalle, la fusion passe par un tri
+DENSE_LIMIT = 20_000_000
+
+
+def bucket_index(values):
+    """Intervalle de chaque valeur (les valeurs inférieures à 1 € vont dans l'intervalle 0)."""
+    return np.ceil(np.log(np.maximum(values, 1.0)) / LOG_GAMMA).astype(np.int16)
+
+
+def bucket_value(buckets):
+    """Valeur représentative d'un intervalle (erreur relative ≤ RELATIVE_ACCURACY)."""
+    return 2 * GAMMA ** np.asarray(buckets, dtype=np.float64) / (GAMMA + 1)
+
+
+def build_sketches(foncieres):
+    """Sketches creux par cellule département × commune × année × mois.
+
+    Les champs de la cellule et l'intervalle sont empaquetés dans un entier
+    64 bits : un seul `np.unique` compte toutes les paires cellule/intervalle.
+    """
+    valeurs = foncieres["Valeur fonciere"].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(valeurs)
+    dept = pd.Categorical(foncieres["Code departement"])
+
+    key = dept.codes[valid].astype(np.int64) + 1  # 0 = département inconnu
+    fields = {
+        "code_insee": foncieres["code_insee"].to_numpy()[valid].astype(np.int64) + 1,
+        "annee": foncieres["annee"].to_numpy()[valid].astype(np.int64) - _YEAR_BASE,
+        "mois": foncieres["mois"].to_numpy()[valid].astype(np.int64),
+        "bucket": bucket_index(valeurs[valid]).astype(np.int64),
+    }
+    for name, bits in _BITS.items():
+        key = (key << bits) | fields[name]
+    del fields
+
+    uniques, counts = np.unique(key, return_counts=True)
+    decoded = {}
+    for name, bits in reversed(_BITS.items()):
+        decoded[name] = uniques & ((1 << bits) - 1)
+        uniques = uniques >> bits
+
+    dept_codes = uniques - 1
+    return pd.DataFrame({
+        "Code departement": pd.Categorical.from_codes(dept_codes, categories=dept.categories),
+        "code_insee": (decoded["code_insee"] - 1).astype(np.int32),
+        "annee": (decoded["annee"] + _YEAR_BASE).astype(np.int16),
+        "mois": decoded["mois"].astype(np.int8),
+        "bucket": decoded["bucket"].astype(np.int16),
+        "n": counts.astype(np.int32),
+    })
+
+
+def sketch_stats(sketches, keys=(), quantiles=QUANTILES):
+    """Fusionne les sketches par groupe `keys` et en déduit effectif, moyenne et quantiles.
+
+    Même format de sortie que `aggregations.grouped_stats` (valeurs approchées
+    à RELATIVE_ACCURACY près) ; sans `keys`, un seul groupe pour tout le jeu.
+    """
+    keys = list(keys)
+    if keys:
+        groups = sketches.groupby(keys, observed=True, sort=True).ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    else:
+        groups = np.zeros(len(sketches), dtype=np.int64)
+    valid = groups >= 0  # clé manquante (ex. département inconnu) : ignorée
+    groups = groups[valid]
+    buckets = sketches["bucket"].to_numpy()[valid].astype(np.int64)
+    n = sketches["n"].to_numpy()[valid].astype(np.int64)
+
+    # Fusion : effectif par (groupe, intervalle), trié par groupe puis intervalle
+    n_buckets = int(buckets.max()) + 1 if len(buckets) else 1
+    n_groups = int(groups.max()) + 1 if len(groups) else 0
+    flat = groups * n_buckets + buckets
+    if n_groups * n_buckets <= DENSE_LIMIT:
+        # Peu de groupes : histogrammes denses, sans tri
+        counts = np.bincount(flat, weights=n, minlength=n_groups * n_buckets)
+        merged = np.flatnonzero(counts)
+        counts = counts[merged].astype(np.int64)
+    else:
+        merged, inverse = np.unique(flat, return_inverse=True)
+        counts = np.bincount(inverse, weights=n).astype(np.int64)
+    group_of = merged // n_buckets
+    values = bucket_value(merged % n_buckets)
+
+    if len(merged) == 0:
+        columns = keys + ["Valeur_mediane", "Valeur_moyenne", "Nb_transactions"]
+        columns += [f"Valeur_q{int(round(q * 100))}" for q in quantiles]
+        return pd.DataFrame(columns=columns)
+
+    starts = np.flatnonzero(np.r_[True, group_of[1:] != group_of[:-1]])
+    totals = np.add.reduceat(counts, starts)
+    cumul = np.cumsum(counts)
+    before = cumul[starts] - counts[starts]
+
+    def value_at(rank):
+        # Premier intervalle du groupe dont l'effectif cumulé dépasse le rang
+        return values[np.searchsorted(cumul, before + rank, side="right")]
+
+    def quantile(q):
+        rank = q * (totals - 1)
+        lo = np.floor(rank)
+        hi = np.ceil(rank)
+        v_lo = value_at(lo)
+        v_hi = value_at(hi)
+        return v_lo + (v_hi - v_lo) * (rank - lo)
+
+    if keys:
+        first_row = pd.Series(np.flatnonzero(valid)).groupby(groups).first().to_numpy()
+        result = sketches.iloc[first_row][keys].reset_index(drop=True)
+    else:
+        result = pd.DataFrame(index=[0])
+    result["Valeur_mediane"] = quantile(0.5)
+    result["Valeur_moyenne"] = np.add.reduceat(values * counts, starts) / totals
+    result["Nb_transactions"] = totals
+    for q in quantiles:
+        result[f"Valeur_q{int(round(q * 100))}"] = quantile(q)
+    return result